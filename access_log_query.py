@@ -0,0 +1,173 @@
+# access_log_query.py
+import base64
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy import and_, or_, select
+
+from database import RegistroAcesso, db
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Linhas buscadas por vez do cursor do banco na exportação
+EXPORT_CHUNK = 1000
+
+CSV_HEADER = ['id', 'pessoa_id', 'nome_identificado', 'reconhecido', 'data_hora', 'ultimo_visto',
+              'ocorrencias', 'origem']
+
+_COLUMNS = (RegistroAcesso.id, RegistroAcesso.pessoa_id, RegistroAcesso.nome_identificado,
+            RegistroAcesso.reconhecido, RegistroAcesso.data_hora, RegistroAcesso.ultimo_visto,
+            RegistroAcesso.ocorrencias, RegistroAcesso.origem)
+
+
+def encode_cursor(data_hora, registro_id):
+    """Cursor opaco que aponta para logo depois do registro (data_hora, id)."""
+    raw = f"{data_hora.isoformat()}|{registro_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        data_hora, registro_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(data_hora), int(registro_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+
+def _parse_datetime(value, name, end_of_day=False):
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Data inválida em '{name}': use AAAA-MM-DD ou AAAA-MM-DDTHH:MM:SS")
+    # Só a data: 'fim' inclui o dia inteiro
+    if end_of_day and len(value) == 10:
+        parsed += datetime.timedelta(days=1)
+    return parsed
+
+
+def parse_filters(args):
+    """
+    Lê os filtros da query string. Levanta ValueError com a mensagem para o cliente.
+
+    Aceita inicio/fim (data ou data e hora), pessoa_id, reconhecido
+    (true/false), origem, cursor e limit.
+    """
+    filters = {}
+    if args.get('inicio'):
+        filters['inicio'] = _parse_datetime(args['inicio'], 'inicio')
+    if args.get('fim'):
+        filters['fim'] = _parse_datetime(args['fim'], 'fim', end_of_day=True)
+    if args.get('pessoa_id'):
+        try:
+            filters['pessoa_id'] = int(args['pessoa_id'])
+        except ValueError:
+            raise ValueError("pessoa_id deve ser um número")
+    if args.get('reconhecido'):
+        value = args['reconhecido'].lower()
+        if value not in ('true', 'false', '1', '0'):
+            raise ValueError("reconhecido deve ser true ou false")
+        filters['reconhecido'] = value in ('true', '1')
+    if args.get('origem'):
+        filters['origem'] = args['origem']
+    if args.get('cursor'):
+        filters['cursor'] = decode_cursor(args['cursor'])
+    if args.get('limit'):
+        try:
+            limit = int(args['limit'])
+        except ValueError:
+            raise ValueError("limit deve ser um número")
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError(f"limit deve estar entre 1 e {MAX_LIMIT}")
+        filters['limit'] = limit
+    return filters
+
+
+def build_query(filters):
+    """
+    Consulta ordenada por (data_hora, id) decrescentes, com paginação por
+    keyset: a próxima página começa logo depois do cursor, sem OFFSET.
+    Os índices compostos de `RegistroAcesso` cobrem a ordenação e os filtros.
+    """
+    query = select(*_COLUMNS)
+    if 'inicio' in filters:
+        query = query.where(RegistroAcesso.data_hora >= filters['inicio'])
+    if 'fim' in filters:
+        query = query.where(RegistroAcesso.data_hora < filters['fim'])
+    if 'pessoa_id' in filters:
+        query = query.where(RegistroAcesso.pessoa_id == filters['pessoa_id'])
+    if 'reconhecido' in filters:
+        query = query.where(RegistroAcesso.reconhecido == filters['reconhecido'])
+    if 'origem' in filters:
+        query = query.where(RegistroAcesso.origem == filters['origem'])
+    if 'cursor' in filters:
+        data_hora, registro_id = filters['cursor']
+        query = query.where(or_(RegistroAcesso.data_hora < data_hora,
+                                and_(RegistroAcesso.data_hora == data_hora, RegistroAcesso.id < registro_id)))
+    return query.order_by(RegistroAcesso.data_hora.desc(), RegistroAcesso.id.desc())
+
+
+def _last_seen(row):
+    # Registros anteriores às sessões não têm ultimo_visto
+    return row.ultimo_visto or row.data_hora
+
+
+def row_to_dict(row):
+    return {
+        "id": row.id,
+        "pessoa_id": row.pessoa_id,
+        "nome_identificado": row.nome_identificado,
+        "reconhecido": row.reconhecido,
+        "data_hora": row.data_hora.isoformat(),
+        "timestamp": str(row.data_hora),
+        "primeiro_visto": row.data_hora.isoformat(),
+        "ultimo_visto": _last_seen(row).isoformat(),
+        "ocorrencias": row.ocorrencias,
+        "origem": row.origem,
+    }
+
+
+def fetch_page(filters):
+    """Retorna (registros, próximo cursor ou None) de uma página."""
+    limit = filters.get('limit', DEFAULT_LIMIT)
+    # Uma linha a mais indica se existe próxima página
+    rows = db.session.execute(build_query(filters).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].data_hora, rows[-1].id)
+    return [row_to_dict(row) for row in rows], next_cursor
+
+
+def _stream_rows(filters):
+    query = build_query(filters)
+    if 'limit' in filters:
+        query = query.limit(filters['limit'])
+    # Cursor do lado do servidor (PostgreSQL) e leitura em blocos: memória constante
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=EXPORT_CHUNK))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+
+def stream_ndjson(filters):
+    for row in _stream_rows(filters):
+        yield json.dumps(row_to_dict(row)) + '\n'
+
+
+def stream_csv(filters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for count, row in enumerate(_stream_rows(filters), start=1):
+        writer.writerow([row.id, row.pessoa_id, row.nome_identificado, row.reconhecido, row.data_hora.isoformat(),
+                         _last_seen(row).isoformat(), row.ocorrencias, row.origem])
+        if count % EXPORT_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,317 @@
+# access_log_sink.py
+import atexit
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import bindparam, insert, update
+
+from database import RegistroAcesso, db
+from observability import get_logger, span
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+log = get_logger('access_log')
+
+
+def _try_lock(f):
+    """Trava o arquivo de forma exclusiva sem bloquear. Retorna False se outro processo o detém."""
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _release_and_delete(f, path):
+    f.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class AccessLogSink:
+    """
+    Grava os registros de acesso em segundo plano, em lotes.
+
+    Cada evento é anexado a um arquivo de spool local (uma linha JSON) e
+    guardado em memória; uma thread grava os eventos acumulados com um
+    insert em massa quando o lote chega a `batch_size` ou a cada
+    `flush_interval` segundos. O segmento do spool só é apagado depois do
+    commit, e segmentos deixados por um processo que caiu são regravados
+    na próxima inicialização (entrega "pelo menos uma vez": uma queda entre
+    o commit e a remoção do arquivo pode duplicar aquele lote). Um lote que
+    falhou é retentado sozinho, com os mesmos segmentos: com o banco fora do
+    ar os eventos novos continuam no segmento ativo, sem abrir arquivos novos.
+
+    Com `dedup_window` > 0, reconhecimentos da mesma pessoa (ou de
+    "Desconhecido") vindos da mesma origem com menos de `dedup_window`
+    segundos entre si formam uma sessão: só o primeiro vira um insert, e
+    `ultimo_visto`/`ocorrencias` da linha são atualizados no máximo uma vez
+    por janela e ao fim da sessão. As sessões ficam em memória, por processo.
+    """
+
+    def __init__(self, app, spool_dir, batch_size=200, flush_interval=1.0, fsync=False, dedup_window=0.0):
+        self.app = app
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.dedup_window = dedup_window
+        # (pessoa_id, origem) -> sessão aberta
+        self._sessions = {}
+        self._cond = threading.Condition()
+        self._pid = None
+        self._buffer = []
+        # Segmentos de spool cujos eventos estão em `_buffer`: (arquivo, caminho)
+        self._segments = []
+        self._active = None
+        self._active_path = None
+        # Eventos anexados ao segmento ativo desde que ele foi aberto
+        self._active_events = 0
+        # Lote que falhou ao gravar, retentado antes de qualquer outro: (lote, segmentos)
+        self._retry = None
+        self._in_flight = 0
+        self._seq = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.merged = 0
+        self.last_flush = None
+        atexit.register(self.close)
+
+    def submit(self, pessoa_id, nome_identificado, reconhecido, data_hora, origem=None):
+        """Enfileira um registro de acesso. Retorna imediatamente."""
+        self._ensure_started()
+        with self._cond:
+            sessao = None
+            if self.dedup_window > 0:
+                key = (pessoa_id, origem)
+                session = self._sessions.get(key)
+                if session and (data_hora - session['ultimo_visto']).total_seconds() <= self.dedup_window:
+                    session['ultimo_visto'] = max(session['ultimo_visto'], data_hora)
+                    session['ocorrencias'] += 1
+                    self.merged += 1
+                    return
+                if session:
+                    self._close_session(key, session, data_hora)
+                sessao = uuid.uuid4().hex
+                self._sessions[key] = {'sessao': sessao, 'ultimo_visto': data_hora, 'ocorrencias': 1,
+                                       'gravadas': 1, 'gravado_em': data_hora}
+            self._append({
+                'pessoa_id': pessoa_id,
+                'nome_identificado': nome_identificado,
+                'reconhecido': reconhecido,
+                'data_hora': data_hora.isoformat(),
+                'ultimo_visto': data_hora.isoformat(),
+                'ocorrencias': 1,
+                'origem': origem,
+                'sessao': sessao,
+            })
+
+    def depth(self):
+        """Eventos ainda não gravados no banco (em memória + lote sendo gravado)."""
+        with self._cond:
+            return len(self._buffer) + self._in_flight + (len(self._retry[0]) if self._retry else 0)
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'flushed': self.flushed,
+            'failed_flushes': self.failed_flushes,
+            'merged': self.merged,
+            'open_sessions': len(self._sessions),
+            'dedup_window': self.dedup_window,
+            'last_flush': self.last_flush.isoformat() if self.last_flush else None,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+        }
+
+    def flush(self):
+        """Grava agora tudo o que estiver pendente. Retorna True se deu certo."""
+        while True:
+            with self._cond:
+                if not self._buffer and self._retry is None:
+                    return True
+                batch, segments = self._take_batch()
+            if not self._write(batch, segments):
+                return False
+
+    def close(self):
+        """Fecha as sessões abertas e grava os eventos pendentes ao encerrar o processo."""
+        if self._pid == os.getpid():
+            with self._cond:
+                self._emit_sessions(datetime.datetime.now(), force=True)
+            self.flush()
+
+    def _append(self, event):
+        """Anexa o evento ao spool e ao lote em memória (com `_cond` travado)."""
+        self._active.write(json.dumps(event) + '\n')
+        self._active.flush()
+        if self.fsync:
+            os.fsync(self._active.fileno())
+        self._active_events += 1
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self._cond.notify()
+
+    def _close_session(self, key, session, now):
+        del self._sessions[key]
+        if session['ocorrencias'] != session['gravadas']:
+            self._append_update(session, now)
+
+    def _append_update(self, session, now):
+        self._append({
+            'tipo': 'update',
+            'sessao': session['sessao'],
+            'ultimo_visto': session['ultimo_visto'].isoformat(),
+            'ocorrencias': session['ocorrencias'],
+        })
+        session['gravadas'] = session['ocorrencias']
+        session['gravado_em'] = now
+
+    def _emit_sessions(self, now, force=False):
+        """
+        Grava o progresso das sessões (com `_cond` travado): atualiza no máximo
+        uma vez por janela as que seguem ativas e fecha as inativas há mais
+        de uma janela. Com `force`, fecha todas.
+        """
+        for key, session in list(self._sessions.items()):
+            if force or (now - session['ultimo_visto']).total_seconds() > self.dedup_window:
+                self._close_session(key, session, now)
+            elif (session['ocorrencias'] != session['gravadas']
+                  and (now - session['gravado_em']).total_seconds() >= self.dedup_window):
+                self._append_update(session, now)
+
+    def _ensure_started(self):
+        # Após um fork (workers do servidor), a thread e o spool são recriados no filho
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._buffer = []
+            self._segments = []
+            self._sessions = {}
+            self._retry = None
+            self._in_flight = 0
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._open_active()
+            self._replay_orphans()
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='access-log-sink', daemon=True).start()
+
+    def _open_active(self):
+        self._seq += 1
+        name = f"spool-{os.getpid()}-{int(time.time() * 1000)}-{self._seq}.jsonl"
+        self._active_path = os.path.join(self.spool_dir, name)
+        self._active = open(self._active_path, 'a+', encoding='utf-8')
+        self._active_events = 0
+        _try_lock(self._active)
+
+    def _replay_orphans(self):
+        """Recarrega eventos de segmentos que nenhum processo vivo está usando."""
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'spool-*.jsonl'))):
+            if path == self._active_path:
+                continue
+            f = open(path, 'r+', encoding='utf-8')
+            if not _try_lock(f):
+                f.close()
+                continue
+            for line in f:
+                line = line.strip()
+                if line:
+                    self._buffer.append(json.loads(line))
+                    replayed += 1
+            self._segments.append((f, path))
+        if replayed:
+            log.info(f"♻️  {replayed} registro(s) de acesso recuperado(s) do spool")
+
+    def _take_batch(self):
+        """
+        Separa o próximo lote (com `_cond` travado): o que falhou na última
+        tentativa, se houver, ou os eventos em memória. O segmento ativo só é
+        girado se recebeu eventos desde que foi aberto.
+        """
+        if self._retry is not None:
+            (batch, segments), self._retry = self._retry, None
+        else:
+            batch, self._buffer = self._buffer, []
+            if self._active_events:
+                self._segments.append((self._active, self._active_path))
+                self._open_active()
+            segments, self._segments = self._segments, []
+        self._in_flight += len(batch)
+        return batch, segments
+
+    def _write(self, batch, segments):
+        parse = datetime.datetime.fromisoformat
+        # Os inserts vêm antes dos updates: a linha de uma sessão está neste lote ou num anterior
+        rows = [{
+            'pessoa_id': event['pessoa_id'],
+            'nome_identificado': event['nome_identificado'],
+            'reconhecido': event['reconhecido'],
+            'data_hora': parse(event['data_hora']),
+            'ultimo_visto': parse(event.get('ultimo_visto') or event['data_hora']),
+            'ocorrencias': event.get('ocorrencias', 1),
+            'origem': event.get('origem'),
+            'sessao': event.get('sessao'),
+        } for event in batch if event.get('tipo') != 'update']
+        updates = [{'b_sessao': event['sessao'], 'b_ultimo_visto': parse(event['ultimo_visto']),
+                    'b_ocorrencias': event['ocorrencias']}
+                   for event in batch if event.get('tipo') == 'update']
+        table = RegistroAcesso.__table__
+        try:
+            with self.app.app_context(), span('db_write'):
+                if rows:
+                    db.session.execute(insert(RegistroAcesso), rows)
+                if updates:
+                    db.session.execute(update(table).where(table.c.sessao == bindparam('b_sessao'))
+                                       .values(ultimo_visto=bindparam('b_ultimo_visto'),
+                                               ocorrencias=bindparam('b_ocorrencias')), updates)
+                db.session.commit()
+        except Exception:
+            log.exception(f"❌ Erro ao gravar {len(batch)} registro(s) de acesso")
+            with self._cond:
+                # O lote volta inteiro para a próxima tentativa; o spool continua no disco
+                self._retry = (batch, segments)
+                self._in_flight -= len(batch)
+                self.failed_flushes += 1
+            return False
+        with self._cond:
+            self._in_flight -= len(batch)
+            self.flushed += len(batch)
+            self.last_flush = datetime.datetime.now()
+        for f, path in segments:
+            _release_and_delete(f, path)
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                with self._cond:
+                    self._cond.wait_for(lambda: len(self._buffer) >= self.batch_size, timeout=self.flush_interval)
+                    if self._sessions:
+                        self._emit_sessions(datetime.datetime.now())
+                    if not self._buffer and self._retry is None:
+                        continue
+                    batch, segments = self._take_batch()
+                if not self._write(batch, segments):
+                    # Banco indisponível: espera antes de tentar de novo
+                    time.sleep(self.flush_interval)
+            except Exception:
+                # A thread não pode morrer: sem ela nada mais seria gravado
+                log.exception("❌ Erro na thread de gravação dos registros de acesso")
+                time.sleep(self.flush_interval)
@@ -1,60 +1,259 @@
 # backend/add_known_faces.py
-import json
+import argparse
+import datetime
 import face_recognition
+import hashlib
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import numpy as np
-from app import app, db
-from database import Pessoa # Importa o modelo Pessoa do seu database.py
+from sqlalchemy import insert, update
+from app import app, db, gallery
+from database import (FaceEncoding, Pessoa, encoding_to_blob, person_encodings_matrix, # Importa os modelos do seu database.py
+                      registrar_alteracao_galeria, set_person_encodings)
 
 # Caminho para a pasta com as fotos das pessoas conhecidas
 KNOWN_FACES_DIR = 'known_faces_data'
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
 def add_face_to_db(image_path, person_name):
-    print(f"Processando {person_name} de {image_path}...")
-    try:
-        image = face_recognition.load_image_file(image_path)
-        face_encodings = face_recognition.face_encodings(image)
+    return add_person_images_to_db([image_path], person_name)
+
+def add_person_images_to_db(image_paths, person_name, append=False):
+    """
+    Cadastra uma pessoa com um encoding por imagem.
+
+    Com `append=True` os encodings são somados aos já cadastrados em vez de
+    substituí-los. Imagens sem face são ignoradas.
+    """
+    print(f"Processando {person_name} ({len(image_paths)} imagem(ns))...")
+    known_encodings = []
+    known_hashes = []
+    for image_path in image_paths:
+        try:
+            image_hash = file_sha256(image_path)
+            image = face_recognition.load_image_file(image_path)
+            face_encodings = face_recognition.face_encodings(image)
+        except Exception as e:
+            print(f"Erro ao processar {image_path} para {person_name}: {e}")
+            continue
 
         if not face_encodings:
             print(f"AVISO: Nenhuma face encontrada em {image_path} para {person_name}.")
-            return False
+            continue
 
-        # Para simplicidade, pegamos o primeiro encoding encontrado na imagem
-        # Se você tiver múltiplas faces por pessoa ou quiser mais robustez, precisaria de lógica extra
-        known_encoding = face_encodings[0]
+        # Para simplicidade, pegamos o primeiro encoding encontrado em cada imagem
+        known_encodings.append(face_encodings[0])
+        known_hashes.append(image_hash)
 
-        # Converte o array numpy para uma lista para armazenar como JSON
-        encoding_list = known_encoding.tolist()
+    if not known_encodings:
+        return False
 
+    try:
         with app.app_context():
             # Verifica se a pessoa já existe
-            pessoa_existente = Pessoa.query.filter_by(nome=person_name).first()
-            if pessoa_existente:
-                print(f"Pessoa '{person_name}' já existe no banco de dados. Atualizando encoding.")
-                pessoa_existente.encodings_json = json.dumps([encoding_list])
+            pessoa = Pessoa.query.filter_by(nome=person_name).first()
+            if pessoa:
+                print(f"Pessoa '{person_name}' já existe no banco de dados. Atualizando encodings.")
             else:
-                nova_pessoa = Pessoa(nome=person_name, encodings_json=json.dumps([encoding_list]))
-                db.session.add(nova_pessoa)
+                pessoa = Pessoa(nome=person_name)
+                db.session.add(pessoa)
+            # Grava os encodings em binário (float32) na tabela FaceEncoding
+            set_person_encodings(pessoa, known_encodings, append=append, hashes=known_hashes)
+            db.session.flush()
+            # Os servidores em execução recebem a alteração pelo log gallery_version
+            registrar_alteracao_galeria([pessoa.id])
             db.session.commit()
-            print(f"Pessoa '{person_name}' adicionada/atualizada no banco de dados.")
+            # Mantém a galeria em memória atualizada quando rodando no mesmo processo do servidor
+            gallery.upsert_person(pessoa.id, pessoa.nome, person_encodings_matrix(pessoa), pessoa.tolerancia)
+            print(f"Pessoa '{person_name}' adicionada/atualizada com {len(known_encodings)} encoding(s).")
             return True
 
     except Exception as e:
-        print(f"Erro ao processar {image_path} para {person_name}: {e}")
+        print(f"Erro ao gravar {person_name}: {e}")
         return False
 
+def file_sha256(path):
+    """SHA-256 do conteúdo do arquivo, usado para não reprocessar a mesma imagem."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def encode_image_file(job):
+    """
+    Executado nos processos do pool: decodifica a imagem e gera o encoding.
+
+    Recebe (nome, caminho, hash) e retorna (nome, caminho, hash, blob ou None,
+    erro ou None, segundos de decodificação, segundos de detecção + encoding).
+    Um erro numa imagem não derruba o lote: ela é contada como falha.
+    """
+    person_name, image_path, image_hash = job
+    start = time.perf_counter()
+    try:
+        image = face_recognition.load_image_file(image_path)
+    except Exception as e:
+        return person_name, image_path, image_hash, None, f"erro ao ler: {e}", time.perf_counter() - start, 0.0
+    decoded = time.perf_counter()
+    try:
+        face_encodings = face_recognition.face_encodings(image)
+    except Exception as e:
+        return (person_name, image_path, image_hash, None, f"erro no encoding: {e}",
+                decoded - start, time.perf_counter() - decoded)
+    blob = encoding_to_blob(face_encodings[0]) if face_encodings else None
+    return person_name, image_path, image_hash, blob, None, decoded - start, time.perf_counter() - decoded
+
+def write_batch(rows):
+    """
+    Grava um lote de (nome, hash, blob) com inserts em massa.
+
+    Cria as pessoas que ainda não existem, insere todos os encodings de uma
+    vez e avança `atualizado_em` das pessoas tocadas, para que a galeria dos
+    servidores em execução carregue os novos encodings.
+    """
+    names = {name for name, _, _ in rows}
+    with app.app_context():
+        ids = dict(db.session.query(Pessoa.nome, Pessoa.id).filter(Pessoa.nome.in_(names)).all())
+        missing = names - ids.keys()
+        if missing:
+            db.session.execute(insert(Pessoa), [{'nome': name} for name in missing])
+            ids.update(db.session.query(Pessoa.nome, Pessoa.id).filter(Pessoa.nome.in_(missing)).all())
+        now = datetime.datetime.utcnow()
+        db.session.execute(insert(FaceEncoding), [
+            {'pessoa_id': ids[name], 'vetor': blob, 'origem_hash': image_hash, 'criado_em': now}
+            for name, image_hash, blob in rows
+        ])
+        db.session.execute(update(Pessoa).where(Pessoa.id.in_(list(ids.values()))).values(atualizado_em=now))
+        registrar_alteracao_galeria(ids.values())
+        db.session.commit()
+
+def bulk_ingest(people, workers=None, batch_size=200):
+    """
+    Cadastro em lote: encoding em paralelo num ProcessPoolExecutor e gravação em massa.
+
+    Os encodings são somados aos já existentes. Imagens cujo hash já está
+    em `FaceEncoding.origem_hash` são puladas, então uma execução
+    interrompida pode ser retomada rodando o mesmo comando de novo.
+    """
+    jobs = [(name, path) for name, paths in people.items() for path in paths]
+    print(f"📦 Cadastro em lote: {len(jobs)} imagem(ns) de {len(people)} pessoa(s)")
+
+    # Etapa 1: hash do conteúdo, para retomar de onde parou
+    start = time.perf_counter()
+    with app.app_context():
+        stored = {h for (h,) in db.session.query(FaceEncoding.origem_hash)
+                  .filter(FaceEncoding.origem_hash.isnot(None)).all()}
+    pending, seen = [], set()
+    for name, path in jobs:
+        image_hash = file_sha256(path)
+        if image_hash in stored or image_hash in seen:
+            continue
+        seen.add(image_hash)
+        pending.append((name, path, image_hash))
+    hash_time = time.perf_counter() - start
+    print(f"   hash: {len(jobs)} imagens em {hash_time:.1f}s ({len(jobs) / max(hash_time, 1e-9):.1f} img/s), "
+          f"{len(jobs) - len(pending)} já cadastrada(s)")
+    if not pending:
+        return
+
+    # Etapa 2: decodificação + encoding no pool, com no máximo 4 tarefas por processo em voo
+    workers = workers or os.cpu_count() or 1
+    decode_time = encode_time = write_time = 0.0
+    encoded = no_face = failed = 0
+    batch = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        queue = iter(pending)
+        in_flight = set()
+        while True:
+            for job in queue:
+                in_flight.add(executor.submit(encode_image_file, job))
+                if len(in_flight) >= 4 * workers:
+                    break
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, path, image_hash, blob, error, t_decode, t_encode = future.result()
+                decode_time += t_decode
+                encode_time += t_encode
+                if error:
+                    failed += 1
+                    print(f"❌ Falha em {path} para {name}: {error}")
+                    continue
+                if blob is None:
+                    no_face += 1
+                    print(f"AVISO: Nenhuma face encontrada em {path} para {name}.")
+                    continue
+                batch.append((name, image_hash, blob))
+                encoded += 1
+
+            # Etapa 3: gravação em massa a cada `batch_size` encodings
+            if len(batch) >= batch_size or (not in_flight and batch):
+                t = time.perf_counter()
+                write_batch(batch)
+                write_time += time.perf_counter() - t
+                batch = []
+                elapsed = time.perf_counter() - start
+                done_count = encoded + no_face + failed
+                print(f"   {done_count}/{len(pending)} imagens ({done_count / elapsed:.1f} img/s)")
+
+    wall = time.perf_counter() - start
+    processed = encoded + no_face + failed
+    print(f"✅ {encoded} encoding(s) gravado(s), {no_face} imagem(ns) sem face, "
+          f"{failed} com falha, {wall:.1f}s no total")
+    print(f"   decodificação: {processed / max(decode_time, 1e-9):.1f} img/s por processo")
+    print(f"   detecção + encoding: {processed / max(encode_time, 1e-9):.1f} img/s por processo, "
+          f"{processed / max(wall, 1e-9):.1f} img/s com {workers} processo(s)")
+    print(f"   gravação no banco: {encoded / max(write_time, 1e-9):.1f} img/s")
+
+def person_name_from(entry):
+    """O nome da pessoa vem do nome do arquivo (sem extensão) ou da pasta."""
+    return os.path.splitext(entry)[0].replace('_', ' ').title()
+
+def scan_known_faces(base_dir):
+    """
+    Retorna {nome: [caminhos]} a partir da pasta de rostos conhecidos.
+
+    Aceita tanto uma imagem por pessoa (maria_barbara.png) quanto uma pasta
+    por pessoa com várias imagens (maria_barbara/01.jpg, maria_barbara/02.jpg).
+    """
+    people = {}
+    for entry in sorted(os.listdir(base_dir)):
+        path = os.path.join(base_dir, entry)
+        if os.path.isdir(path):
+            images = [os.path.join(path, f) for f in sorted(os.listdir(path))
+                      if f.lower().endswith(IMAGE_EXTENSIONS)]
+            if images:
+                people.setdefault(person_name_from(entry), []).extend(images)
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            people.setdefault(person_name_from(entry), []).append(path)
+    return people
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cadastra as pessoas da pasta de rostos conhecidos.")
+    parser.add_argument('--dir', default=KNOWN_FACES_DIR, help="pasta com as imagens (padrão: known_faces_data)")
+    parser.add_argument('--append', action='store_true',
+                        help="soma os encodings aos já cadastrados em vez de substituí-los")
+    parser.add_argument('--bulk', action='store_true',
+                        help="cadastro em lote paralelo e retomável (sempre soma os encodings)")
+    parser.add_argument('--workers', type=int, default=None, help="processos do modo --bulk (padrão: nº de CPUs)")
+    parser.add_argument('--batch-size', type=int, default=200, help="encodings por insert no modo --bulk")
+    args = parser.parse_args()
+
     # Certifique-se de que o app.py pode ser importado e as tabelas criadas
     with app.app_context():
         db.create_all() # Cria as tabelas se elas não existirem
 
-    # Percorre as imagens na pasta KNOWN_FACES_DIR
-    for filename in os.listdir(KNOWN_FACES_DIR):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            image_path = os.path.join(KNOWN_FACES_DIR, filename)
-            # O nome da pessoa será o nome do arquivo (sem extensão)
-            person_name = os.path.splitext(filename)[0].replace('_', ' ').title()
-            add_face_to_db(image_path, person_name)
+    # Percorre as imagens (ou pastas por pessoa) em KNOWN_FACES_DIR
+    people = scan_known_faces(args.dir)
+    if args.bulk:
+        bulk_ingest(people, workers=args.workers, batch_size=args.batch_size)
+    else:
+        for person_name, image_paths in people.items():
+            add_person_images_to_db(image_paths, person_name, append=args.append)
 
     print("\nProcessamento de rostos conhecidos concluído.")
-    print("Execute 'python app.py' para iniciar o servidor Flask.")
\ No newline at end of file
+    print("Execute 'python app.py' para iniciar o servidor Flask.")
@@ -0,0 +1,10 @@
+"""
+Benchmarks do reconhecimento facial.
+
+    bench_pipeline   etapas do /recognize isoladas e de ponta a ponta, em SQLite e Postgres (JSON)
+    compare          compara dois JSON do bench_pipeline e aponta regressões
+    bench_detection  latência e precisão de cada perfil de detecção
+    bench_ann        recall e latência da busca aproximada (IVF) contra a exata
+
+Rode da raiz do projeto, por exemplo `python -m benchmarks.bench_pipeline`.
+"""
@@ -0,0 +1,88 @@
+# benchmarks/bench_ann.py
+"""
+Compara recall e latência da busca aproximada (IVF) com a busca exata.
+
+Gera uma galeria sintética de encodings agrupados por identidade (como os
+do dlib, em que fotos da mesma pessoa ficam próximas) e mede, para cada
+valor de nprobe, o recall@1 em relação à força bruta e a latência por lote.
+
+Uso:
+    python benchmarks/bench_ann.py --size 100000 --nprobe 1 4 8 16 32
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from matching import squared_norms  # noqa: E402
+from search_index import ExactIndex, IVFIndex  # noqa: E402
+
+
+class _Snapshot:
+    """Subconjunto de `gallery.GallerySnapshot` usado pelos backends de busca."""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.sq_norms = squared_norms(matrix)
+
+
+def synthetic_gallery(size, dim=128, per_person=2, spread=0.05, seed=0):
+    """Retorna (galeria, consultas): identidades espalhadas com `per_person` fotos cada."""
+    rng = np.random.default_rng(seed)
+    people = max(1, size // per_person)
+    centers = rng.normal(scale=0.1, size=(people, dim)).astype(np.float32)
+    gallery = np.repeat(centers, per_person, axis=0)[:size]
+    gallery += rng.normal(scale=spread, size=gallery.shape).astype(np.float32)
+    return gallery, centers
+
+
+def timed_search(view, queries, snapshot, k, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = view.search(queries, snapshot, k)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='encodings na galeria')
+    parser.add_argument('--queries', type=int, default=64, help='faces por lote de consulta')
+    parser.add_argument('--nlist', type=int, default=0, help='listas do IVF (0 = automático)')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--k', type=int, default=16, help='candidatos por consulta')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gallery, centers = synthetic_gallery(args.size, seed=args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    picks = rng.choice(len(centers), size=args.queries, replace=len(centers) < args.queries)
+    queries = centers[picks] + rng.normal(scale=0.05, size=(args.queries, gallery.shape[1])).astype(np.float32)
+    snapshot = _Snapshot(gallery)
+
+    print(f"Galeria: {len(gallery)} encodings, {args.queries} consultas por lote")
+    (exact_idx, _), exact_time = timed_search(ExactIndex().freeze(len(gallery)), queries, snapshot,
+                                              args.k, args.repeats)
+    print(f"{'backend':<16}{'recall@1':>10}{'ms/lote':>12}{'ms/face':>10}")
+    print(f"{'exact':<16}{1.0:>10.4f}{exact_time * 1000:>12.2f}{exact_time * 1000 / args.queries:>10.3f}")
+
+    index = IVFIndex(nlist=args.nlist)
+    start = time.perf_counter()
+    index.train(gallery, seed=args.seed)
+    print(f"(IVF com {len(index.centroids)} listas treinado em {time.perf_counter() - start:.1f}s)")
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        (idx, _), elapsed = timed_search(index.freeze(len(gallery)), queries, snapshot, args.k, args.repeats)
+        recall = float(np.mean(idx[:, 0] == exact_idx[:, 0]))
+        label = f"ivf nprobe={nprobe}"
+        print(f"{label:<16}{recall:>10.4f}{elapsed * 1000:>12.2f}{elapsed * 1000 / args.queries:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_detection.py
+"""
+Mede latência e precisão de cada perfil de detecção do /recognize.
+
+Para cada imagem de `imagens/` (e de `backend/known_faces_data`), roda
+detecção + encoding com cada perfil. A referência de precisão é o perfil
+`--reference` (padrão: preciso): para cada face da referência, procura a
+caixa correspondente (IoU >= 0.5) no perfil testado e mede a distância
+entre os dois encodings. Com --prefilter, cada perfil roda também com o
+pré-filtro em cascata do OpenCV (linhas '<perfil>+cascade').
+
+Uso:
+    python benchmarks/bench_detection.py
+    python benchmarks/bench_detection.py --profiles rapido padrao --repeats 5
+    python benchmarks/bench_detection.py --profiles padrao --prefilter
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.common import image_paths  # noqa: E402
+from face_pipeline import PROFILES, box_iou, decode_image, detect_faces, encode_faces  # noqa: E402
+
+
+def run_profile(image, profile, repeats):
+    best_detect = best_encode = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        locations = detect_faces(image, profile)
+        detected = time.perf_counter()
+        encodings = encode_faces(image, locations, profile)
+        best_detect = min(best_detect, detected - start)
+        best_encode = min(best_encode, time.perf_counter() - detected)
+    return locations, encodings, best_detect, best_encode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=sorted(PROFILES), choices=sorted(PROFILES))
+    parser.add_argument('--reference', default='preciso', choices=sorted(PROFILES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--prefilter', action='store_true', help="compara também cada perfil com prefilter=cascade")
+    parser.add_argument('images', nargs='*', help="imagens a usar (padrão: imagens/ e known_faces_data)")
+    args = parser.parse_args()
+
+    paths = args.images or image_paths()
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((os.path.basename(path), decode_image(f.read())))
+    print(f"{len(images)} imagem(ns): " + ", ".join(f"{name} {img.shape[1]}x{img.shape[0]}" for name, img in images))
+
+    reference = {name: run_profile(img, PROFILES[args.reference], 1)[:2] for name, img in images}
+
+    variants = [(name, PROFILES[name]) for name in args.profiles]
+    if args.prefilter:
+        variants += [(f"{name}+cascade", profile._replace(prefilter='cascade')) for name, profile in variants]
+
+    print(f"{'perfil':<16}{'detecção ms':>13}{'encoding ms':>13}{'faces':>7}{'recall':>8}{'dist. média':>13}")
+    for profile_name, profile in variants:
+        detect_ms = encode_ms = 0.0
+        faces = found = 0
+        distances = []
+        for name, image in images:
+            locations, encodings, t_detect, t_encode = run_profile(image, profile, args.repeats)
+            detect_ms += t_detect * 1000
+            encode_ms += t_encode * 1000
+            faces += len(locations)
+            ref_locations, ref_encodings = reference[name]
+            for ref_box, ref_encoding in zip(ref_locations, ref_encodings):
+                overlaps = [box_iou(ref_box, box) for box in locations]
+                if overlaps and max(overlaps) >= 0.5:
+                    found += 1
+                    match = encodings[int(np.argmax(overlaps))]
+                    distances.append(float(np.linalg.norm(match - ref_encoding)))
+        total_ref = sum(len(ref[0]) for ref in reference.values())
+        recall = found / total_ref if total_ref else float('nan')
+        mean_distance = np.mean(distances) if distances else float('nan')
+        print(f"{profile_name:<16}{detect_ms / len(images):>13.1f}{encode_ms / len(images):>13.1f}"
+              f"{faces:>7}{recall:>8.2f}{mean_distance:>13.4f}")
+    print(f"(tempos médios por imagem; recall e distância em relação ao perfil '{args.reference}')")
+
+
+if __name__ == '__main__':
+    main()
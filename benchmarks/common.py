@@ -0,0 +1,101 @@
+# benchmarks/common.py
+"""Utilidades compartilhadas pelos benchmarks: imagens, galerias sintéticas, tempos e JSON."""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+IMAGE_DIRS = [os.path.join(ROOT, 'imagens'), os.path.join(ROOT, 'backend', 'known_faces_data')]
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def image_paths(dirs=IMAGE_DIRS):
+    """Imagens reais do projeto (imagens/ e backend/known_faces_data), em ordem estável."""
+    return [os.path.join(d, f) for d in dirs if os.path.isdir(d)
+            for f in sorted(os.listdir(d)) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def unit_rows(matrix):
+    """Normaliza cada linha para norma 1."""
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def synthetic_people(people, per_person=2, spread=0.03, dim=128, seed=0):
+    """
+    Galeria sintética: `people` identidades com `per_person` encodings cada.
+
+    Cada identidade é um vetor aleatório de norma 1 e seus encodings são
+    variações dele, também normalizadas. Identidades diferentes ficam a
+    ~1.4 de distância e fotos da mesma pessoa bem abaixo da tolerância.
+    Retorna (centros (P, dim), encodings (P * per_person, dim)) em float32.
+    """
+    rng = np.random.default_rng(seed)
+    centers = unit_rows(rng.normal(size=(people, dim))).astype(np.float32)
+    encodings = np.repeat(centers, per_person, axis=0)
+    encodings += rng.normal(scale=spread, size=encodings.shape).astype(np.float32)
+    return centers, unit_rows(encodings).astype(np.float32)
+
+
+def timings(fn, repeats, warmup=1):
+    """Roda `fn` `warmup + repeats` vezes e resume os tempos (em ms) das medidas."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def summarize(samples):
+    """min, mediana, p95 e média em ms de uma lista de durações em segundos."""
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(ms):
+        return {'n': 0}
+    return {
+        'n': int(len(ms)),
+        'min_ms': round(float(ms.min()), 4),
+        'median_ms': round(float(np.median(ms)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'mean_ms': round(float(ms.mean()), 4),
+    }
+
+
+def git_commit():
+    """(hash do commit atual, se há alterações não commitadas); (None, None) fora de um repositório git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def environment():
+    """Metadados da execução, gravados junto com os resultados."""
+    commit, dirty = git_commit()
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write('\n')
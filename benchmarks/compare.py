@@ -0,0 +1,74 @@
+# benchmarks/compare.py
+"""
+Compara dois resultados do bench_pipeline e aponta regressões.
+
+Para cada (banco, tamanho da galeria, etapa) presente nos dois arquivos,
+compara a mediana. Uma etapa regrediu se ficou mais lenta que a base por
+mais de --threshold (relativo) e por mais de --min-delta ms (absoluto, para
+ignorar ruído em etapas de microssegundos). Sai com código 1 se houver
+alguma regressão, para uso em scripts.
+
+Uso:
+    python -m benchmarks.compare base.json novo.json
+    python -m benchmarks.compare base.json novo.json --threshold 0.2 --metric p95_ms
+"""
+import argparse
+import json
+import sys
+
+
+def load_stages(path, metric):
+    """{(banco, tamanho, etapa): valor} de um arquivo de resultados."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    stages = {}
+    for run in data['runs']:
+        if 'error' in run:
+            continue
+        rows = list(run['stages'].items()) + [('recognize (e2e)', run['end_to_end']['recognize'])]
+        for stage, stats in rows:
+            if metric in stats:
+                stages[(run['database'], run['gallery_size'], stage)] = stats[metric]
+    return data.get('meta', {}), stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='median_ms', choices=['min_ms', 'median_ms', 'p95_ms', 'mean_ms'])
+    parser.add_argument('--threshold', type=float, default=0.10, help='piora relativa tolerada (0.10 = 10%%)')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='piora absoluta mínima em ms')
+    args = parser.parse_args()
+
+    base_meta, base = load_stages(args.base, args.metric)
+    new_meta, new = load_stages(args.new, args.metric)
+    print(f"base: {(base_meta.get('commit') or '?')[:12]}  novo: {(new_meta.get('commit') or '?')[:12]}"
+          f"  ({args.metric})")
+    print(f"{'banco':<10}{'galeria':>9}  {'etapa':<22}{'base':>11}{'novo':>11}{'variação':>10}")
+
+    regressions = 0
+    for key in sorted(base.keys() & new.keys(), key=str):
+        database, size, stage = key
+        before, after = base[key], new[key]
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > args.threshold and after - before > args.min_delta:
+            flag = '  REGRESSÃO'
+            regressions += 1
+        elif change < -args.threshold and before - after > args.min_delta:
+            flag = '  melhora'
+        print(f"{database:<10}{size:>9}  {stage:<22}{before:>11.3f}{after:>11.3f}{change:>+10.1%}{flag}")
+
+    missing = sorted(base.keys() ^ new.keys(), key=str)
+    if missing:
+        print(f"\n{len(missing)} etapa(s) presentes em só um dos arquivos: "
+              + ", ".join(f"{d}/{s}/{stage}" for d, s, stage in missing))
+    if regressions:
+        print(f"\n❌ {regressions} regressão(ões) acima de {args.threshold:.0%}")
+        sys.exit(1)
+    print("\n✅ Nenhuma regressão")
+
+
+if __name__ == '__main__':
+    main()
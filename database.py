@@ -1,19 +1,176 @@
+import datetime
+import json
+
+import numpy as np
 from flask_sqlalchemy import SQLAlchemy
 # Remova a linha "from app import db"
-import face_recognition
+from sqlalchemy import insert, inspect, text
+
+from observability import get_logger
 
 db = SQLAlchemy()
 
+# Encodings são gravados como blobs float32 de 128 posições (512 bytes)
+ENCODING_DTYPE = np.float32
+ENCODING_DIM = 128
+
+# Canal do LISTEN/NOTIFY do Postgres avisado a cada alteração da galeria
+GALLERY_CHANNEL = 'gallery_changes'
+
 # Mova suas classes de modelo para cá
 class Pessoa(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), unique=True, nullable=False)
-    encodings_json = db.Column(db.Text, nullable=False)
+    # Formato antigo (lista JSON de encodings). Os encodings agora ficam em
+    # `FaceEncoding`; a coluna só é lida para pessoas ainda não migradas
+    # (ver migrar_encodings.py).
+    encodings_json = db.Column(db.Text, nullable=False, default='[]')
+    # Marca d'água usada pela galeria em memória para recarregar só o que mudou
+    atualizado_em = db.Column(db.DateTime, nullable=False, index=True,
+                              default=datetime.datetime.utcnow,
+                              onupdate=datetime.datetime.utcnow)
+    # Tolerância própria da pessoa no reconhecimento (vazio = FACE_MATCH_TOLERANCE)
+    tolerancia = db.Column(db.Float, nullable=True)
     registros = db.relationship('RegistroAcesso', backref='pessoa', lazy=True)
+    encodings = db.relationship('FaceEncoding', backref='pessoa', lazy=True,
+                                cascade='all, delete-orphan', order_by='FaceEncoding.id')
+
+class FaceEncoding(db.Model):
+    """Um encoding (embedding de 128 dimensões) de uma pessoa, em binário."""
+    id = db.Column(db.Integer, primary_key=True)
+    pessoa_id = db.Column(db.Integer, db.ForeignKey('pessoa.id'), nullable=False, index=True)
+    vetor = db.Column(db.LargeBinary, nullable=False)
+    # SHA-256 da imagem de origem, usado para retomar cadastros em lote
+    origem_hash = db.Column(db.String(64), nullable=True, index=True)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
 
 class RegistroAcesso(db.Model):
+    # Índices compostos para a paginação por (data_hora, id) do /access_log e seus filtros
+    __table_args__ = (
+        db.Index('ix_registro_acesso_data_hora_id', 'data_hora', 'id'),
+        db.Index('ix_registro_acesso_pessoa_data_hora', 'pessoa_id', 'data_hora', 'id'),
+        db.Index('ix_registro_acesso_reconhecido_data_hora', 'reconhecido', 'data_hora', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     pessoa_id = db.Column(db.Integer, db.ForeignKey('pessoa.id'), nullable=True)
     nome_identificado = db.Column(db.String(100), nullable=False)
     reconhecido = db.Column(db.Boolean, nullable=False)
-    data_hora = db.Column(db.DateTime, nullable=False)
\ No newline at end of file
+    # Início da sessão: reconhecimentos repetidos da mesma pessoa (ou "Desconhecido")
+    # na mesma origem dentro da janela viram um só registro (ver access_log_sink.py)
+    data_hora = db.Column(db.DateTime, nullable=False)
+    ultimo_visto = db.Column(db.DateTime, nullable=True)
+    ocorrencias = db.Column(db.Integer, nullable=False, default=1)
+    # Câmera/cliente que enviou a imagem (campo 'origem' ou o IP)
+    origem = db.Column(db.String(64), nullable=True)
+    # Chave da sessão, usada para atualizar ultimo_visto e ocorrencias em lote
+    sessao = db.Column(db.String(32), nullable=True, index=True)
+
+class VersaoGaleria(db.Model):
+    """
+    Log de alterações da galeria: uma linha por pessoa cadastrada, alterada
+    ou removida. O id crescente é a versão; cada worker aplica as linhas
+    com id maior que a última que viu (ver gallery_events.py).
+    """
+    __tablename__ = 'gallery_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    pessoa_id = db.Column(db.Integer, nullable=False)
+    # 'upsert' ou 'delete'; o worker sempre relê o estado atual da pessoa
+    operacao = db.Column(db.String(10), nullable=False, default='upsert')
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+
+def registrar_alteracao_galeria(pessoa_ids, operacao='upsert'):
+    """
+    Registra na sessão atual que a galeria mudou para `pessoa_ids`.
+
+    Deve ser chamado antes do commit que grava a alteração: o log entra na
+    mesma transação e, no Postgres, o NOTIFY só é entregue aos workers se
+    ela for confirmada.
+    """
+    pessoa_ids = sorted(set(pessoa_ids))
+    if not pessoa_ids:
+        return
+    agora = datetime.datetime.utcnow()
+    db.session.execute(insert(VersaoGaleria), [{'pessoa_id': pessoa_id, 'operacao': operacao, 'criado_em': agora}
+                                               for pessoa_id in pessoa_ids])
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_notify(:canal, :payload)'),
+                           {'canal': GALLERY_CHANNEL, 'payload': operacao})
+
+
+def encoding_to_blob(encoding):
+    """Converte um encoding em blob float32 para a coluna `FaceEncoding.vetor`."""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).reshape(ENCODING_DIM).tobytes()
+
+
+def blobs_to_matrix(blobs):
+    """
+    Converte uma sequência de blobs em uma matriz (N, 128) float32.
+
+    Os blobs são concatenados uma única vez e lidos com `np.frombuffer`,
+    sem parse de texto nem um array por encoding.
+    """
+    blobs = list(blobs)
+    if not blobs:
+        return np.empty((0, ENCODING_DIM), dtype=ENCODING_DTYPE)
+    return np.frombuffer(b''.join(blobs), dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM)
+
+
+def set_person_encodings(pessoa, encodings, append=False, hashes=None):
+    """
+    Grava os encodings da pessoa e avança sua marca `atualizado_em`.
+
+    Com `append=False` os encodings anteriores são substituídos; com
+    `append=True` os novos são somados aos já cadastrados. `hashes`, se
+    dado, traz o SHA-256 da imagem de origem de cada encoding.
+    """
+    hashes = hashes or [None] * len(encodings)
+    novos = [FaceEncoding(vetor=encoding_to_blob(encoding), origem_hash=origem_hash)
+             for encoding, origem_hash in zip(encodings, hashes)]
+    if append:
+        # Pessoa ainda no formato JSON: traz os encodings antigos para a tabela
+        if not pessoa.encodings and pessoa.encodings_json not in (None, '', '[]'):
+            antigos = json.loads(pessoa.encodings_json)
+            novos = [FaceEncoding(vetor=encoding_to_blob(encoding)) for encoding in antigos] + novos
+        pessoa.encodings.extend(novos)
+    else:
+        pessoa.encodings = novos
+    pessoa.encodings_json = '[]'
+    # Alterar só as linhas filhas não dispara o `onupdate` da pessoa
+    pessoa.atualizado_em = datetime.datetime.utcnow()
+
+
+def person_encodings_matrix(pessoa):
+    """Retorna todos os encodings gravados da pessoa como matriz (N, 128)."""
+    return blobs_to_matrix(encoding.vetor for encoding in pessoa.encodings)
+
+
+def atualizar_esquema():
+    """
+    Adiciona às tabelas existentes as colunas novas dos modelos.
+
+    O `db.create_all()` só cria tabelas que ainda não existem; bancos
+    criados por versões anteriores precisam receber as colunas novas aqui.
+    Deve ser chamado dentro de um app context, após o `create_all()`.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existentes = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existentes:
+                    continue
+                col_type = column.type.compile(dialect=db.engine.dialect)
+                get_logger('database').info(f"🛠️  Adicionando coluna {table.name}.{column.name}")
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+                if column.default is not None and (column.default.is_callable or column.default.is_scalar):
+                    # Preenche as linhas antigas com o valor padrão da coluna
+                    valor = column.default.arg(None) if column.default.is_callable else column.default.arg
+                    conn.execute(text(f'UPDATE {table.name} SET {column.name} = :valor'),
+                                 {'valor': valor})
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,428 @@
+# face_pipeline.py
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+# Perfil de detecção usado no /recognize:
+# - max_side: maior lado da imagem usada na detecção (0 = resolução original)
+# - model: detector do dlib, 'hog' (CPU, rápido) ou 'cnn' (mais preciso, caro sem GPU)
+# - upsample: quantas vezes a imagem é ampliada pelo detector (acha rostos menores)
+# - landmarks: modelo de pontos faciais do encoding, 'small' (5 pontos) ou 'large' (68)
+# - jitters: reamostragens por encoding (mais lento, um pouco mais estável)
+# - prefilter: primeira etapa barata antes do dlib, 'none' ou 'cascade' (classificador
+#   em cascata do OpenCV: frames sem face saem na hora e o dlib só roda nas regiões achadas)
+DetectionProfile = namedtuple('DetectionProfile', ['max_side', 'model', 'upsample', 'landmarks', 'jitters',
+                                                   'prefilter'], defaults=('none',))
+
+PROFILES = {
+    'rapido': DetectionProfile(max_side=480, model='hog', upsample=0, landmarks='small', jitters=1),
+    'padrao': DetectionProfile(max_side=800, model='hog', upsample=1, landmarks='small', jitters=1),
+    'preciso': DetectionProfile(max_side=0, model='cnn', upsample=1, landmarks='large', jitters=1),
+}
+DEFAULT_PROFILE = 'padrao'
+# Cadastro: os parâmetros padrão do `face_recognition.face_encodings` na imagem inteira
+REGISTER_PROFILE = DetectionProfile(max_side=0, model='hog', upsample=1, landmarks='small', jitters=1)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class ArchiveTooLarge(ValueError):
+    """O arquivo compactado passa dos limites de imagens ou de bytes descompactados."""
+
+# O face_recognition importa o dlib e lê todos os arquivos de modelo: só é
+# carregado no primeiro uso, pelos caminhos de inferência (ver `face_models`)
+_face_recognition = None
+_models_lock = threading.Lock()
+
+# Pré-filtro em cascata: a imagem é reduzida para este maior lado (em tons de
+# cinza) antes da cascata, e cada região achada é ampliada por esta margem
+# (fração do lado) para o dlib ver a face inteira
+PREFILTER_MAX_SIDE = 240
+PREFILTER_MARGIN = 0.5
+# Parâmetros da cascata: vizinhos mínimos baixos para perder poucas faces (os
+# falsos positivos são descartados pelo dlib); passo de escala e menor face em
+# pixels da imagem reduzida
+PREFILTER_MIN_NEIGHBORS = 3
+PREFILTER_SCALE_FACTOR = 1.2
+PREFILTER_MIN_SIZE = 24
+# Cascata padrão do OpenCV; FACE_PREFILTER_CASCADE aponta outro XML (por exemplo, uma LBP)
+PREFILTER_CASCADE = 'haarcascade_frontalface_default.xml'
+_cascade = None
+
+# Campo do perfil -> (variável de ambiente, conversão)
+_FIELDS = {
+    'max_side': ('FACE_DETECT_MAX_SIDE', int),
+    'model': ('FACE_DETECT_MODEL', str),
+    'upsample': ('FACE_DETECT_UPSAMPLE', int),
+    'landmarks': ('FACE_LANDMARK_MODEL', str),
+    'jitters': ('FACE_NUM_JITTERS', int),
+    'prefilter': ('FACE_DETECT_PREFILTER', str),
+}
+
+
+def face_models():
+    """Retorna o módulo face_recognition, importando-o (com dlib e modelos) na primeira chamada."""
+    global _face_recognition
+    if _face_recognition is None:
+        with _models_lock:
+            if _face_recognition is None:
+                import face_recognition
+                _face_recognition = face_recognition
+    return _face_recognition
+
+
+def face_cascade():
+    """Classificador em cascata do pré-filtro, carregado (com o cv2) na primeira chamada."""
+    global _cascade
+    if _cascade is None:
+        with _models_lock:
+            if _cascade is None:
+                import cv2
+                path = os.environ.get('FACE_PREFILTER_CASCADE') or PREFILTER_CASCADE
+                if not os.path.isabs(path) and not os.path.exists(path):
+                    path = os.path.join(cv2.data.haarcascades, path)
+                cascade = cv2.CascadeClassifier(path)
+                if cascade.empty():
+                    raise ValueError(f"Não foi possível carregar a cascata do pré-filtro: {path}")
+                _cascade = cascade
+    return _cascade
+
+
+def validate_profile(profile):
+    """Levanta ValueError se algum campo do perfil for inválido."""
+    if profile.max_side < 0:
+        raise ValueError("max_side deve ser >= 0")
+    if profile.model not in ('hog', 'cnn'):
+        raise ValueError("model deve ser 'hog' ou 'cnn'")
+    if not 0 <= profile.upsample <= 3:
+        raise ValueError("upsample deve estar entre 0 e 3")
+    if profile.landmarks not in ('small', 'large'):
+        raise ValueError("landmarks deve ser 'small' ou 'large'")
+    if not 1 <= profile.jitters <= 100:
+        raise ValueError("jitters deve estar entre 1 e 100")
+    if profile.prefilter not in ('none', 'cascade'):
+        raise ValueError("prefilter deve ser 'none' ou 'cascade'")
+    return profile
+
+
+def _apply_overrides(profile, values):
+    changes = {}
+    for field, (_, convert) in _FIELDS.items():
+        value = values.get(field)
+        if value not in (None, ''):
+            try:
+                changes[field] = convert(value)
+            except ValueError:
+                raise ValueError(f"Valor inválido para {field}: {value}")
+    return validate_profile(profile._replace(**changes))
+
+
+def _named_profile(name):
+    if name not in PROFILES:
+        raise ValueError(f"Perfil de detecção desconhecido: {name} (use um de {sorted(PROFILES)})")
+    return PROFILES[name]
+
+
+def profile_from_env():
+    """Perfil padrão da instalação: FACE_DETECT_PROFILE mais os ajustes individuais do .env."""
+    base = _named_profile(os.environ.get('FACE_DETECT_PROFILE', DEFAULT_PROFILE))
+    return _apply_overrides(base, {field: os.environ.get(env) for field, (env, _) in _FIELDS.items()})
+
+
+def profile_from_request(form, default):
+    """
+    Perfil de uma requisição: o campo 'profile' escolhe um perfil nomeado e
+    os campos max_side, model, upsample, landmarks e jitters ajustam o resultado.
+    Sem nenhum desses campos, retorna `default`.
+    """
+    base = _named_profile(form['profile']) if form.get('profile') else default
+    return _apply_overrides(base, form)
+
+
+def decode_image(data, mode='RGB'):
+    """Decodifica os bytes de uma imagem para um array numpy RGB (como `load_image_file`)."""
+    image = Image.open(io.BytesIO(data))
+    if mode:
+        image = image.convert(mode)
+    return np.asarray(image)
+
+
+def _downscale(image, max_side):
+    """Reduz a imagem para que o maior lado seja `max_side`. Retorna (imagem, escala)."""
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if not max_side or longest <= max_side:
+        return image, 1.0
+    scale = max_side / longest
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small = Image.fromarray(image).resize(size, Image.BILINEAR)
+    return np.asarray(small), scale
+
+
+def box_iou(a, b):
+    """IoU entre duas caixas (top, right, bottom, left)."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area = lambda box: (box[2] - box[0]) * (box[1] - box[3])  # noqa: E731
+    union = area(a) + area(b) - inter
+    return inter / union if union else 0.0
+
+
+def _merge_regions(regions):
+    """Junta as regiões que se sobrepõem, para o dlib não ver a mesma face duas vezes."""
+    merged = []
+    for region in sorted(regions):
+        for i, other in enumerate(merged):
+            if region[0] < other[2] and other[0] < region[2] and region[3] < other[1] and other[3] < region[1]:
+                merged[i] = (min(region[0], other[0]), max(region[1], other[1]),
+                             max(region[2], other[2]), min(region[3], other[3]))
+                break
+        else:
+            merged.append(region)
+    return merged if len(merged) == len(regions) else _merge_regions(merged)
+
+
+def propose_regions(image):
+    """
+    Pré-filtro: roda a cascata do OpenCV numa cópia pequena em tons de cinza
+    e devolve as regiões (top, right, bottom, left), já com margem e na
+    resolução original, onde pode haver uma face. Lista vazia = frame sem face.
+    """
+    import cv2
+    height, width = image.shape[:2]
+    scale = min(1.0, PREFILTER_MAX_SIDE / max(height, width))
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                          interpolation=cv2.INTER_AREA)
+    gray = cv2.equalizeHist(gray)
+    found = face_cascade().detectMultiScale(gray, scaleFactor=PREFILTER_SCALE_FACTOR,
+                                            minNeighbors=PREFILTER_MIN_NEIGHBORS,
+                                            minSize=(PREFILTER_MIN_SIZE, PREFILTER_MIN_SIZE))
+    regions = []
+    for x, y, w, h in found:
+        margin = PREFILTER_MARGIN * max(w, h)
+        regions.append((max(0, int((y - margin) / scale)), min(width, int(round((x + w + margin) / scale))),
+                        min(height, int(round((y + h + margin) / scale))), max(0, int((x - margin) / scale))))
+    return _merge_regions(regions)
+
+
+def detect_faces(image, profile, regions=None):
+    """
+    Detecta as faces na imagem reduzida do perfil e devolve as caixas
+    (top, right, bottom, left) na resolução original.
+
+    Com o pré-filtro do perfil (ou `regions` já calculadas), o dlib roda só
+    dentro de cada região e as caixas são trazidas de volta para a imagem.
+    """
+    if regions is None and profile.prefilter == 'cascade':
+        regions = propose_regions(image)
+    if regions is not None:
+        boxes = []
+        for r_top, r_right, r_bottom, r_left in regions:
+            crop = np.ascontiguousarray(image[r_top:r_bottom, r_left:r_right])
+            boxes.extend((top + r_top, right + r_left, bottom + r_top, left + r_left)
+                         for top, right, bottom, left in detect_faces(crop, profile._replace(prefilter='none')))
+        return boxes
+    small, scale = _downscale(image, profile.max_side)
+    locations = face_models().face_locations(small, number_of_times_to_upsample=profile.upsample,
+                                             model=profile.model)
+    if scale == 1.0:
+        return locations
+    height, width = image.shape[:2]
+    return [(max(0, int(top / scale)), min(width, int(round(right / scale))),
+             min(height, int(round(bottom / scale))), max(0, int(left / scale)))
+            for top, right, bottom, left in locations]
+
+
+def encode_faces(image, locations, profile):
+    """Gera os encodings das faces já localizadas, na resolução original."""
+    if not locations:
+        return []
+    return face_models().face_encodings(image, locations, num_jitters=profile.jitters,
+                                        model=profile.landmarks)
+
+
+def detect_and_encode(image, profile):
+    """Retorna (caixas, encodings) das faces da imagem segundo o perfil."""
+    locations = detect_faces(image, profile)
+    return locations, encode_faces(image, locations, profile)
+
+
+def warm_up():
+    """Carrega os modelos e roda o detector uma vez numa imagem vazia, para inicializá-lo."""
+    face_models().face_locations(np.zeros((64, 64, 3), dtype=np.uint8))
+
+
+# Funções executadas nos processos do pool de inferência (inference_pool.py):
+# recebem os bytes da imagem e devolvem resultados pequenos, baratos de serializar.
+
+def process_image_bytes(data, profile):
+    """
+    Decodifica, detecta e gera os encodings. Retorna (caixas, encodings em
+    float32, tempos em segundos de cada etapa: decode, detect e encode).
+
+    Com o pré-filtro, os tempos trazem também 'prefilter'; um frame rejeitado
+    por ele volta sem 'detect' nem 'encode'.
+    """
+    start = time.perf_counter()
+    image = decode_image(data)
+    decoded = time.perf_counter()
+    timings = {'decode': decoded - start}
+    regions = None
+    if profile.prefilter == 'cascade':
+        regions = propose_regions(image)
+        timings['prefilter'] = time.perf_counter() - decoded
+        if not regions:
+            return [], [], timings
+        decoded = time.perf_counter()
+    locations = detect_faces(image, profile, regions)
+    detected = time.perf_counter()
+    encodings = encode_faces(image, locations, profile)
+    timings.update(detect=detected - decoded, encode=time.perf_counter() - detected)
+    return locations, [np.asarray(encoding, dtype=np.float32) for encoding in encodings], timings
+
+
+def process_images_bytes(datas, profile):
+    """
+    Várias imagens numa só tarefa do pool (usado pelo /recognize_batch).
+    Retorna, por imagem, (caixas, encodings, tempos) ou a exceção que ela levantou.
+    """
+    results = []
+    for data in datas:
+        try:
+            results.append(process_image_bytes(data, profile))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def process_image_files(paths, profile):
+    """
+    Como `process_images_bytes`, mas lendo os arquivos no próprio processo
+    do pool (usado pelo reidentificar.py, para o processo principal não
+    carregar as imagens). Retorna, por arquivo, (caixas, encodings, tempos)
+    ou a exceção que ele levantou.
+    """
+    results = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            results.append(process_image_bytes(data, profile))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def detect_image_bytes(data, profile):
+    """Só a detecção: retorna as caixas na resolução original."""
+    return detect_faces(decode_image(data), profile)
+
+
+def encode_image_bytes(data, locations, profile):
+    """Só os encodings das caixas dadas, em float32."""
+    encodings = encode_faces(decode_image(data), locations, profile)
+    return [np.asarray(encoding, dtype=np.float32) for encoding in encodings]
+
+
+def chip_size(data):
+    """(largura, altura) de um recorte lendo só o cabeçalho da imagem, sem decodificá-la."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError("Recorte não é uma imagem válida")
+
+
+def validate_chip(data, box, max_bytes, min_side, max_side):
+    """
+    Confere um recorte de face enviado pelo cliente antes de mandá-lo ao pool.
+
+    `box` é a face dentro do recorte, (top, right, bottom, left); sem ela, o
+    recorte inteiro é a face. Levanta ValueError se o arquivo passar de
+    `max_bytes`, se o recorte não tiver entre `min_side` e `max_side` pixels
+    de lado ou se a caixa sair dele. Retorna a caixa a usar no encoding.
+    """
+    if len(data) > max_bytes:
+        raise ValueError(f"Recorte com {len(data)} bytes, acima do limite de {max_bytes}")
+    width, height = chip_size(data)
+    if min(width, height) < min_side or max(width, height) > max_side:
+        raise ValueError(f"Recorte de {width}x{height}: os lados devem ficar entre {min_side} e {max_side} pixels")
+    if box is None:
+        return (0, width, height, 0)
+    try:
+        top, right, bottom, left = (int(value) for value in box)
+    except (TypeError, ValueError):
+        raise ValueError(f"Caixa inválida: {box}")
+    if not (0 <= top < bottom <= height and 0 <= left < right <= width):
+        raise ValueError(f"Caixa {box} fora do recorte de {width}x{height}")
+    return (top, right, bottom, left)
+
+
+def process_chips_bytes(chips, profile):
+    """
+    Recortes de face já localizados pelo cliente: decodifica cada um e gera
+    só o encoding da caixa dada, sem detecção. `chips` é [(bytes, caixa)].
+    Retorna (um encoding float32 por recorte, tempos de chip_decode e chip_encode).
+    """
+    start = time.perf_counter()
+    images = [decode_image(data) for data, _ in chips]
+    decoded = time.perf_counter()
+    encodings = [np.asarray(encode_faces(image, [box], profile)[0], dtype=np.float32)
+                 for image, (_, box) in zip(images, chips)]
+    return encodings, {'chip_decode': decoded - start, 'chip_encode': time.perf_counter() - decoded}
+
+
+def images_from_archive(data, content_type, max_images, max_image_bytes, max_total_bytes):
+    """
+    Extrai as imagens de um corpo tar ou zip. Retorna [(nome, bytes)] na
+    ordem do arquivo; entradas que não são imagens são ignoradas.
+
+    Os limites valem antes de descompactar: o tamanho de cada imagem é
+    conferido pelo cabeçalho da entrada (e a leitura nunca passa dele, caso
+    o cabeçalho minta) e a leitura para na imagem `max_images` + 1. Levanta
+    ArchiveTooLarge se um limite for ultrapassado e ValueError se o arquivo
+    não puder ser lido.
+    """
+    images = []
+    total = 0
+
+    def take(name, size, open_member):
+        nonlocal total
+        if len(images) == max_images:
+            raise ArchiveTooLarge(f"Máximo de {max_images} imagens por requisição")
+        if size > max_image_bytes:
+            raise ArchiveTooLarge(f"{name}: imagem maior que {max_image_bytes} bytes")
+        if total + size > max_total_bytes:
+            raise ArchiveTooLarge(f"Imagens somam mais de {max_total_bytes} bytes descompactados")
+        with open_member() as f:
+            data = f.read(max_image_bytes + 1)
+        if len(data) > max_image_bytes:
+            raise ArchiveTooLarge(f"{name}: imagem maior que {max_image_bytes} bytes")
+        total += len(data)
+        images.append((name, data))
+
+    try:
+        if 'zip' in content_type:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        take(info.filename, info.file_size, lambda: archive.open(info))
+        else:
+            with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        take(member.name, member.size, lambda: archive.extractfile(member))
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error) as e:
+        raise ValueError(f"Arquivo compactado inválido: {e}")
+    return images
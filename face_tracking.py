@@ -0,0 +1,207 @@
+# face_tracking.py
+import json
+import math
+import threading
+import time
+
+from face_pipeline import box_iou, detect_image_bytes, encode_image_bytes
+from inference_pool import DeadlineExceeded, PoolSaturated
+from matching import match_faces
+
+# Sobreposição mínima entre a caixa atual e a do frame anterior para continuar a mesma trilha
+TRACK_IOU = 0.3
+# Frames seguidos sem a face antes de encerrar a trilha
+TRACK_MAX_MISSED = 5
+# A confiança na identidade de uma trilha cai a cada frame; abaixo do mínimo, gera o encoding de novo
+CONFIDENCE_DECAY = 0.97
+MIN_CONFIDENCE = 0.5
+# Confiança inicial de uma trilha não reconhecida: tenta de novo mais cedo (o rosto pode ter virado)
+UNKNOWN_CONFIDENCE = 0.6
+
+
+class Track:
+    """Uma face acompanhada entre frames, com a última identidade calculada."""
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.missed = 0
+        self.match = None
+        self.confidence = 0.0
+
+    def needs_encoding(self, min_confidence=MIN_CONFIDENCE):
+        return self.match is None or self.confidence < min_confidence
+
+
+class FaceTracker:
+    """
+    Associa as caixas detectadas em cada frame às trilhas do frame anterior
+    (maior IoU primeiro). Só as trilhas novas ou com confiança baixa precisam
+    de um novo encoding; as demais reaproveitam a identidade já calculada.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU, max_missed=TRACK_MAX_MISSED,
+                 decay=CONFIDENCE_DECAY, min_confidence=MIN_CONFIDENCE):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.decay = decay
+        self.min_confidence = min_confidence
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, boxes):
+        """Retorna a trilha de cada caixa, na mesma ordem de `boxes`."""
+        pairs = sorted(((box_iou(track.box, box), t, b) for t, track in enumerate(self.tracks)
+                        for b, box in enumerate(boxes)), reverse=True)
+        assigned = [None] * len(boxes)
+        used = set()
+        for overlap, t, b in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in used or assigned[b] is not None:
+                continue
+            track = self.tracks[t]
+            track.box = boxes[b]
+            track.missed = 0
+            # Movimento brusco também reduz a confiança na identidade
+            track.confidence *= self.decay * min(1.0, overlap / 0.5)
+            assigned[b] = track
+            used.add(t)
+
+        for t, track in enumerate(self.tracks):
+            if t not in used:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        for b, box in enumerate(boxes):
+            if assigned[b] is None:
+                assigned[b] = Track(self._next_id, box)
+                self._next_id += 1
+                self.tracks.append(assigned[b])
+        return assigned
+
+    def assign(self, track, match):
+        """Guarda a identidade calculada para a trilha. Retorna True se ela mudou."""
+        changed = track.match is None or track.match.pessoa_id != match.pessoa_id
+        track.match = match
+        track.confidence = 1.0 if match.recognized else UNKNOWN_CONFIDENCE
+        return changed
+
+
+class RecognitionStream:
+    """
+    Uma sessão de reconhecimento contínuo sobre um WebSocket.
+
+    Uma thread recebe os frames (JPEG/PNG em mensagens binárias) e guarda
+    só o mais recente: se o processamento fica para trás, os frames
+    intermediários são descartados em vez de formar fila. Cada frame
+    processado passa pela detecção; o encoding e a busca na galeria só
+    rodam para as trilhas novas ou com confiança baixa. As duas etapas
+    rodam no pool de inferência; com o pool cheio o frame é descartado.
+
+    `on_identity(pessoa_id, nome, reconhecido)` é chamado quando uma trilha
+    recebe (ou troca de) identidade, para registrar o acesso uma única vez.
+    A galeria é só lida (`gallery.snapshot()`); quem a mantém em dia é o
+    `GalleryRefresher` do processo.
+    """
+
+    def __init__(self, ws, profile, gallery, on_identity, match_options, pool):
+        self.ws = ws
+        self.pool = pool
+        self.profile = profile
+        self.gallery = gallery
+        self.on_identity = on_identity
+        # Argumentos do `match_faces` (tolerância, margem mínima, shortlist)
+        self.match_options = match_options
+        self.tracker = FaceTracker()
+        self._cond = threading.Condition()
+        self._latest = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.encoded = 0
+
+    def run(self):
+        threading.Thread(target=self._receive_loop, name='recognize-stream-rx', daemon=True).start()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._latest is not None or self._closed)
+                if self._latest is None:
+                    return
+                frame, self._latest = self._latest, None
+            try:
+                result = self.process(frame)
+            except (PoolSaturated, DeadlineExceeded):
+                # Servidor sobrecarregado: perde este frame e segue com o próximo
+                with self._cond:
+                    self.dropped += 1
+                continue
+            except Exception as e:
+                result = {"error": str(e)}
+            try:
+                self.ws.send(result_to_json(result))
+            except Exception:
+                return
+
+    def process(self, frame):
+        start = time.perf_counter()
+        boxes = self.pool.call(detect_image_bytes, frame, self.profile)
+        tracks = self.tracker.update(boxes)
+
+        stale = [i for i, track in enumerate(tracks) if track.needs_encoding(self.tracker.min_confidence)]
+        if stale:
+            encodings = self.pool.call(encode_image_bytes, frame, [boxes[i] for i in stale], self.profile)
+            matches = match_faces(encodings, self.gallery.snapshot(), **self.match_options)
+            for i, match in zip(stale, matches):
+                if self.tracker.assign(tracks[i], match):
+                    self.on_identity(match.pessoa_id, match.name, match.recognized)
+            self.encoded += len(stale)
+        self.processed += 1
+
+        encoded = set(stale)
+        return {
+            "frame": self.received,
+            "dropped": self.dropped,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            "faces": [{
+                "track": track.id,
+                "box": list(box),
+                "name": track.match.name,
+                "recognized": track.match.recognized,
+                "distance": track.match.distance,
+                "margin": track.match.margin,
+                "encoded": i in encoded,
+            } for i, (track, box) in enumerate(zip(tracks, boxes))],
+        }
+
+    def _receive_loop(self):
+        try:
+            while True:
+                data = self.ws.receive()
+                if data is None:
+                    break
+                if isinstance(data, str):
+                    # Só frames binários são processados
+                    continue
+                with self._cond:
+                    self.received += 1
+                    if self._latest is not None:
+                        self.dropped += 1
+                    self._latest = data
+                    self._cond.notify()
+        except Exception:
+            pass
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify()
+
+
+def result_to_json(result):
+    for face in result.get("faces", []):
+        # inf não é JSON válido: sem galeria (ou com uma só pessoa) vira null
+        for key in ("distance", "margin"):
+            if not math.isfinite(face[key]):
+                face[key] = None
+    return json.dumps(result)
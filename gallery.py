@@ -0,0 +1,507 @@
+# gallery.py
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import numpy as np
+
+from database import ENCODING_DIM, FaceEncoding, Pessoa, blobs_to_matrix, db
+from matching import (TEMPLATE_MODES, append_template_rows, build_templates, remove_template_people,
+                      squared_norms)
+from observability import get_logger
+from search_index import ExactIndex
+
+log = get_logger('gallery')
+
+# Visão imutável da galeria em um instante: matriz (N, 128), ids, nomes,
+# normas ao quadrado de cada linha e a versão da galeria correspondente.
+# `index` é a visão congelada do backend de busca (ver search_index.py),
+# `templates` o `matching.TemplateSet` por pessoa (None se desativado) e
+# `tolerances` a tolerância da pessoa de cada linha (NaN = a global).
+GallerySnapshot = namedtuple('GallerySnapshot', [
+    'matrix', 'ids', 'names', 'sq_norms', 'version', 'index', 'templates', 'tolerances',
+])
+
+# Estado persistente da galeria (ver FaceGallery.state/restore): as linhas
+# visíveis, a versão aplicada por pessoa ({id: atualizado_em}) e a marca d'água
+GalleryState = namedtuple('GalleryState', ['matrix', 'ids', 'names', 'tolerances', 'applied', 'watermark',
+                                           'version'])
+
+# Galeria gravada em disco (ver FaceGallery.save/load): `gallery.json` traz a
+# marca d'água e aponta para a matriz e os ids gravados com o mesmo carimbo
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_META = 'gallery.json'
+# Arquivos de carimbos antigos só são apagados depois deste tempo (segundos),
+# para não sumirem debaixo de outro processo que acabou de gravar ou de ler
+SNAPSHOT_KEEP_SECONDS = 60
+
+
+class FaceGallery:
+    """
+    Índice em memória das faces conhecidas.
+
+    Mantém todos os encodings em uma única matriz contígua float32 (N, 128),
+    com arrays paralelos de ids e nomes. A matriz é atualizada de forma
+    incremental: só as pessoas alteradas desde a última sincronização são
+    relidas do banco, usando a coluna `Pessoa.atualizado_em` como marca d'água,
+    e seus encodings binários (`FaceEncoding.vetor`) vão direto para a matriz.
+
+    Os leitores nunca veem uma galeria pela metade: cada alteração termina
+    publicando um novo `GallerySnapshot` imutável, trocado numa única
+    atribuição, e `snapshot()` só lê essa referência, sem lock.
+    """
+
+    def __init__(self, dim=ENCODING_DIM, index=None, template_mode='none'):
+        self.dim = dim
+        # Backend de busca (exato ou aproximado), mantido junto com a matriz
+        self.index = index if index is not None else ExactIndex()
+        # Template por pessoa (centroid/medoid) para a busca em duas etapas
+        if template_mode not in TEMPLATE_MODES:
+            raise ValueError(f"Modo de template inválido: {template_mode} (use um de {TEMPLATE_MODES})")
+        self.template_mode = template_mode
+        # Protege as alterações; `_sync_lock` garante um único `sync` por vez
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        # Buffer com capacidade extra: só as primeiras `_size` linhas são válidas
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._names = np.empty(0, dtype=object)
+        # ||b||² de cada linha, pré-calculado para o cálculo de distâncias
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        # `Pessoa.tolerancia` repetida em cada linha da pessoa (NaN = tolerância global)
+        self._tolerances = np.empty(0, dtype=np.float32)
+        self._size = 0
+        # Marca d'água: maior `atualizado_em` já aplicado no índice
+        self.watermark = None
+        # `atualizado_em` aplicado por pessoa, para não reprocessar a mesma versão
+        self._applied = {}
+        # Incrementado a cada alteração do índice
+        self.version = 0
+        # Depois de `load`, o próximo `sync` remove as pessoas apagadas do banco
+        self._prune_pending = False
+        # Templates das linhas atuais, mantidos por pessoa entre as publicações
+        # (None = refazer todos na próxima publicação)
+        self._templates = None
+        self._current = None
+        self._publish(bump=False)
+
+    def __len__(self):
+        return len(self._current.ids)
+
+    def snapshot(self):
+        """
+        Retorna o `GallerySnapshot` publicado, com arrays consistentes entre si.
+
+        As alterações nunca escrevem nas linhas já visíveis de um snapshot
+        (remoções geram novos arrays e inserções escrevem após `_size`) e
+        terminam trocando a referência publicada: ler não exige lock.
+        """
+        return self._current
+
+    def _publish(self, bump=True):
+        """Monta o snapshot do estado atual e o publica (com `_lock` travado)."""
+        with self._lock:
+            if bump:
+                self.version += 1
+            n = self._size
+            if self.template_mode != 'none' and self._templates is None:
+                self._templates = build_templates(self._matrix[:n], self._ids[:n], self.template_mode)
+            self._current = GallerySnapshot(self._matrix[:n], self._ids[:n], self._names[:n],
+                                            self._sq_norms[:n], self.version, self.index.freeze(n), self._templates,
+                                            self._tolerances[:n])
+
+    def upsert_person(self, pessoa_id, nome, encodings, tolerance=None):
+        """Substitui (ou insere) todos os encodings de uma pessoa no índice."""
+        vectors = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        self.replace_people([pessoa_id], np.full(len(vectors), pessoa_id, dtype=np.int64),
+                            np.full(len(vectors), nome, dtype=object), vectors,
+                            np.full(len(vectors), np.nan if tolerance is None else tolerance, dtype=np.float32))
+
+    def replace_people(self, pessoa_ids, row_ids, row_names, vectors, row_tolerances=None):
+        """
+        Substitui de uma vez os encodings de várias pessoas.
+
+        Remove todas as linhas de `pessoa_ids` e insere as linhas dadas
+        (`row_ids`, `row_names`, `vectors` e `row_tolerances` alinhados; sem
+        tolerâncias, vale a global). Pessoas sem nenhuma linha nova ficam fora
+        da galeria. É o caminho usado na carga inicial, para não pagar uma
+        varredura da matriz por pessoa.
+        """
+        if row_tolerances is None:
+            row_tolerances = np.full(len(vectors), np.nan, dtype=np.float32)
+        with self._lock:
+            self._remove_rows(pessoa_ids)
+            self._append_rows(row_ids, row_names, vectors, row_tolerances)
+            self._publish()
+
+    def remove_person(self, pessoa_id):
+        """Remove todos os encodings de uma pessoa do índice."""
+        with self._lock:
+            self._applied.pop(pessoa_id, None)
+            if self._remove_rows([pessoa_id]):
+                self._publish()
+
+    def train_index(self, min_rows=1000):
+        """
+        Treina o backend de busca aproximada, se houver um e ainda não estiver treinado.
+
+        Retorna True se treinou. Galerias com menos de `min_rows` encodings
+        continuam na busca exata, que nesse tamanho já é rápida.
+        """
+        if not hasattr(self.index, 'train'):
+            return False
+        with self._lock:
+            if self.index.trained or self._size < min_rows:
+                return False
+            self.index.train(self._matrix[:self._size])
+            self._publish()
+        if self.index.path:
+            self.index.save()
+        return True
+
+    def sync(self):
+        """
+        Aplica no índice as pessoas alteradas desde a última sincronização.
+
+        Deve ser chamado dentro de um app context. Retorna o número de
+        pessoas atualizadas (0 quando nada mudou). Chamadas simultâneas são
+        serializadas: a segunda só aplica o que a primeira não viu.
+        """
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self):
+        pruned = self._prune_deleted() if self._prune_pending else 0
+        query = db.session.query(Pessoa.id, Pessoa.nome, Pessoa.atualizado_em, Pessoa.encodings_json,
+                                 Pessoa.tolerancia)
+        if self.watermark is not None:
+            # `>=` reaplica as linhas da própria marca d'água, o que é
+            # idempotente e evita perder escritas no mesmo instante.
+            query = query.filter(Pessoa.atualizado_em >= self.watermark)
+        pessoas = [p for p in query.all() if self._applied.get(p.id) != p.atualizado_em]
+        if not pessoas:
+            return pruned
+        self._apply(pessoas, all_people=self.watermark is None)
+        return len(pessoas) + pruned
+
+    def apply_people(self, pessoa_ids):
+        """
+        Relê do banco só as pessoas dadas e aplica o estado atual de cada uma:
+        cadastradas ou alteradas entram (ou são substituídas) na galeria e as
+        que não existem mais saem. Usado pelos eventos de alteração
+        (gallery_events.py). Deve ser chamado dentro de um app context.
+        Retorna o número de pessoas aplicadas.
+        """
+        pessoa_ids = set(pessoa_ids)
+        with self._sync_lock:
+            pessoas = (db.session.query(Pessoa.id, Pessoa.nome, Pessoa.atualizado_em, Pessoa.encodings_json,
+                                        Pessoa.tolerancia)
+                       .filter(Pessoa.id.in_(pessoa_ids)).all())
+            gone = pessoa_ids - {p.id for p in pessoas}
+            if gone:
+                with self._lock:
+                    for pessoa_id in gone:
+                        self._applied.pop(pessoa_id, None)
+                    if self._remove_rows(list(gone)):
+                        self._publish()
+            if pessoas:
+                # A marca d'água não avança: pessoas alteradas sem evento continuam com o `sync`
+                self._apply(pessoas, advance_watermark=False)
+        return len(pessoa_ids)
+
+    def _apply(self, pessoas, all_people=False, advance_watermark=True):
+        """Carrega os encodings de `pessoas` e substitui suas linhas na galeria."""
+        # Todos os encodings das pessoas alteradas em uma única consulta
+        enc_query = db.session.query(FaceEncoding.pessoa_id, FaceEncoding.vetor)
+        if not all_people:
+            enc_query = enc_query.filter(FaceEncoding.pessoa_id.in_([p.id for p in pessoas]))
+        rows = enc_query.order_by(FaceEncoding.pessoa_id, FaceEncoding.id).all()
+        row_ids = np.fromiter((r.pessoa_id for r in rows), dtype=np.int64, count=len(rows))
+        vectors = blobs_to_matrix(r.vetor for r in rows)
+
+        # Pessoas ainda não migradas para `FaceEncoding` são lidas do JSON antigo
+        names = {p.id: p.nome for p in pessoas}
+        with_blobs = set(row_ids.tolist())
+        legacy_ids, legacy_vectors = [], []
+        for pessoa in pessoas:
+            if pessoa.id in with_blobs or not pessoa.encodings_json:
+                continue
+            try:
+                encodings = np.asarray(json.loads(pessoa.encodings_json), dtype=np.float32)
+                encodings = encodings.reshape(-1, self.dim)
+            except Exception as person_error:
+                log.error(f"❌ Erro ao processar pessoa {pessoa.nome}: {person_error}")
+                continue
+            legacy_ids.extend([pessoa.id] * len(encodings))
+            legacy_vectors.append(encodings)
+        if legacy_vectors:
+            row_ids = np.concatenate([row_ids, np.asarray(legacy_ids, dtype=np.int64)])
+            vectors = np.vstack([vectors] + legacy_vectors)
+
+        row_names = np.array([names[i] for i in row_ids.tolist()], dtype=object)
+        tolerances = {p.id: np.nan if p.tolerancia is None else p.tolerancia for p in pessoas}
+        row_tolerances = np.array([tolerances[i] for i in row_ids.tolist()], dtype=np.float32)
+        with self._lock:
+            self.replace_people(list(names), row_ids, row_names, vectors, row_tolerances)
+            for pessoa in pessoas:
+                self._applied[pessoa.id] = pessoa.atualizado_em
+                if advance_watermark and (self.watermark is None or pessoa.atualizado_em > self.watermark):
+                    self.watermark = pessoa.atualizado_em
+
+    def _prune_deleted(self):
+        """Remove da galeria as pessoas que não existem mais no banco. Retorna quantas."""
+        self._prune_pending = False
+        existing = {pessoa_id for (pessoa_id,) in db.session.query(Pessoa.id)}
+        with self._lock:
+            gone = set(np.unique(self._ids[:self._size]).tolist()) - existing
+            if not gone:
+                return 0
+            for pessoa_id in gone:
+                self._applied.pop(pessoa_id, None)
+            self._remove_rows(list(gone))
+            self._publish()
+        return len(gone)
+
+    def save(self, directory, source=None):
+        """
+        Grava a galeria em `directory`, para outro processo mapeá-la com `load`.
+
+        A matriz e os ids vão para arquivos .npy com um carimbo novo no nome;
+        o `gallery.json` (marca d'água, versão aplicada por pessoa, nomes,
+        tolerâncias próprias e `source`, que identifica o banco de origem) é
+        trocado atomicamente por último. Retorna o carimbo, ou None se a
+        galeria estiver vazia.
+        """
+        state = self.state()
+        if not len(state.ids):
+            return None
+        matrix, ids, names, tolerances = state.matrix, state.ids, state.names, state.tolerances
+        meta = {
+            'format': SNAPSHOT_FORMAT,
+            'stamp': uuid.uuid4().hex,
+            'source': source,
+            'rows': len(ids),
+            'dim': self.dim,
+            'version': state.version,
+            'watermark': state.watermark.isoformat() if state.watermark else None,
+            'applied': {str(pessoa_id): stamp.isoformat() for pessoa_id, stamp in state.applied.items()},
+        }
+        meta['names'] = dict(zip(map(str, ids.tolist()), names.tolist()))
+        meta['tolerances'] = {str(pessoa_id): tolerance for pessoa_id, tolerance
+                              in zip(ids.tolist(), tolerances.tolist()) if not np.isnan(tolerance)}
+
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"gallery-{meta['stamp']}")
+        np.save(prefix + '.npy', np.ascontiguousarray(matrix, dtype=np.float32))
+        np.save(prefix + '.ids.npy', ids)
+        tmp = os.path.join(directory, f".{SNAPSHOT_META}.{meta['stamp']}")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(directory, SNAPSHOT_META))
+
+        for path in glob.glob(os.path.join(directory, 'gallery-*.npy')):
+            if meta['stamp'] in os.path.basename(path):
+                continue
+            try:
+                if time.time() - os.path.getmtime(path) > SNAPSHOT_KEEP_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+        return meta['stamp']
+
+    def load(self, directory, source=None):
+        """
+        Mapeia em memória (np.load com mmap) a galeria gravada por `save`, sem ler o banco.
+
+        Só carrega numa galeria vazia e se o snapshot for do mesmo `source`.
+        Retorna False se não houver snapshot utilizável. Em seguida, `sync`
+        traz do banco só o que mudou depois da marca d'água do snapshot e
+        remove as pessoas apagadas. As linhas mapeadas são só lidas: inserções
+        e remoções geram arrays novos em memória.
+        """
+        try:
+            with open(os.path.join(directory, SNAPSHOT_META), encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta.get('format') != SNAPSHOT_FORMAT or meta.get('source') != source
+                    or meta.get('dim') != self.dim or not meta.get('rows')):
+                return False
+            prefix = os.path.join(directory, f"gallery-{meta['stamp']}")
+            matrix = np.load(prefix + '.npy', mmap_mode='r')
+            ids = np.load(prefix + '.ids.npy').astype(np.int64)
+            if matrix.shape != (meta['rows'], self.dim) or matrix.dtype != np.float32 or len(ids) != len(matrix):
+                raise ValueError(f"formato inesperado: {matrix.shape} {matrix.dtype}, {len(ids)} ids")
+            names = np.array([meta['names'][str(pessoa_id)] for pessoa_id in ids.tolist()], dtype=object)
+            own = meta.get('tolerances', {})
+            tolerances = np.array([own.get(str(pessoa_id), np.nan) for pessoa_id in ids.tolist()], dtype=np.float32)
+            parse = datetime.datetime.fromisoformat
+            applied = {int(pessoa_id): parse(stamp) for pessoa_id, stamp in meta['applied'].items()}
+            watermark = parse(meta['watermark']) if meta['watermark'] else None
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError) as e:
+            log.warning(f"⚠️  Snapshot da galeria ignorado ({directory}): {e}")
+            return False
+
+        if not self.restore(GalleryState(matrix, ids, names, tolerances, applied, watermark, None)):
+            return False
+        self._prune_pending = True
+        return True
+
+    def state(self):
+        """
+        Cópia consistente do estado persistente (`GalleryState`). Os arrays
+        são as linhas visíveis, que nunca são alteradas no lugar: podem ser
+        gravadas fora do lock.
+        """
+        with self._lock:
+            n = self._size
+            return GalleryState(self._matrix[:n], self._ids[:n], self._names[:n], self._tolerances[:n],
+                                dict(self._applied), self.watermark, self.version)
+
+    def restore(self, state):
+        """
+        Carrega um `GalleryState` numa galeria vazia, usando os arrays como
+        estão (inclusive mapeados em memória). Retorna False se a galeria já
+        tiver linhas.
+        """
+        with self._lock:
+            if self._size:
+                return False
+            self._matrix = state.matrix
+            self._ids = state.ids
+            self._names = state.names
+            self._tolerances = state.tolerances
+            self._sq_norms = squared_norms(state.matrix)
+            self._size = len(state.matrix)
+            self._templates = None
+            self.index.add(state.matrix)
+            self._applied = dict(state.applied)
+            self.watermark = state.watermark
+            self._publish()
+        return True
+
+    def apply_delta(self, people, state):
+        """
+        Aplica uma alteração parcial: `state` traz as linhas e o `applied` só
+        das pessoas alteradas, e `people` são todas as pessoas que existem na
+        origem (as demais saem da galeria). Pessoas com versão local igual ou
+        mais nova que a do `state` ficam como estão. Retorna quantas pessoas
+        foram alteradas ou removidas.
+        """
+        with self._lock:
+            present = set(self._applied) | set(np.unique(self._ids[:self._size]).tolist())
+            gone = {pessoa_id for pessoa_id in present - set(people)
+                    if state.watermark is None or self._applied.get(pessoa_id, state.watermark) <= state.watermark}
+            newer = {pessoa_id for pessoa_id, stamp in state.applied.items()
+                     if pessoa_id not in self._applied or self._applied[pessoa_id] < stamp}
+            if gone or newer:
+                keep = np.isin(state.ids, list(newer))
+                self.replace_people(list(gone | newer), state.ids[keep], state.names[keep],
+                                    np.asarray(state.matrix[keep], dtype=np.float32), state.tolerances[keep])
+            for pessoa_id in gone:
+                self._applied.pop(pessoa_id, None)
+            self._applied.update({pessoa_id: state.applied[pessoa_id] for pessoa_id in newer})
+            if state.watermark and (self.watermark is None or state.watermark > self.watermark):
+                self.watermark = state.watermark
+        return len(gone | newer)
+
+    def _remove_rows(self, pessoa_ids):
+        n = self._size
+        if n == 0:
+            return False
+        keep = ~np.isin(self._ids[:n], np.asarray(pessoa_ids, dtype=np.int64))
+        if keep.all():
+            return False
+        # Gera novos arrays em vez de compactar no lugar, preservando os
+        # snapshots que outras threads ainda estejam lendo.
+        matrix = self._matrix[:n][keep]
+        self._ids = self._ids[:n][keep]
+        self._names = self._names[:n][keep]
+        self._sq_norms = self._sq_norms[:n][keep]
+        self._tolerances = self._tolerances[:n][keep]
+        self._matrix = matrix
+        self.index.remove(keep)
+        self._size = len(matrix)
+        if self._templates is not None:
+            self._templates = remove_template_people(self._templates, pessoa_ids, keep)
+        return True
+
+    def _append_rows(self, row_ids, row_names, vectors, row_tolerances):
+        count = len(vectors)
+        if count == 0:
+            return
+        needed = self._size + count
+        if needed > len(self._matrix):
+            capacity = max(needed, 2 * len(self._matrix), 16)
+            self._matrix = _grow(self._matrix, self._size, capacity)
+            self._ids = _grow(self._ids, self._size, capacity)
+            self._names = _grow(self._names, self._size, capacity)
+            self._sq_norms = _grow(self._sq_norms, self._size, capacity)
+            self._tolerances = _grow(self._tolerances, self._size, capacity)
+        self._matrix[self._size:needed] = vectors
+        self._ids[self._size:needed] = row_ids
+        self._names[self._size:needed] = row_names
+        self._sq_norms[self._size:needed] = squared_norms(vectors)
+        self._tolerances[self._size:needed] = row_tolerances
+        self.index.add(vectors)
+        if self._templates is not None:
+            self._templates = append_template_rows(self._templates, self._matrix[:needed], self._ids[:needed],
+                                                   self._size, self.template_mode)
+        self._size = needed
+
+
+class GalleryRefresher:
+    """
+    Mantém a galeria de um processo em dia fora do caminho das requisições.
+
+    A primeira chamada de `ensure_started` no processo (também num worker
+    recém-criado por fork) faz a sincronização inicial, e as threads que
+    chegarem juntas esperam por ela em vez de repeti-la. Depois, uma thread
+    chama `sync` a cada `interval` segundos (0 = só nas chamadas explícitas
+    de `refresh`). As alterações feitas por outros processos chegam antes
+    pelo log de alterações (ver gallery_events.py); esta sincronização é a
+    rede de segurança.
+    """
+
+    def __init__(self, sync, interval=2.0):
+        self.sync = sync
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self.refreshes = 0
+        self.last_refresh = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.refresh()
+            if self.interval > 0:
+                threading.Thread(target=self._run, name='gallery-refresh', daemon=True).start()
+            self._pid = os.getpid()
+
+    def refresh(self):
+        """Sincroniza agora, na thread atual. Retorna o que `sync` retornar."""
+        updated = self.sync()
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        return updated
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.refresh()
+
+
+def _grow(array, size, capacity):
+    """Realoca `array` com nova capacidade, copiando as `size` primeiras linhas."""
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:size] = array[:size]
+    return grown
@@ -0,0 +1,267 @@
+# gallery_bundle.py
+"""
+Exporta a galeria para um pacote binário único e o importa no cache local de
+outro nó (a pasta FACE_GALLERY_SNAPSHOT_DIR), sem ler o banco nem recodificar
+fotos.
+
+O pacote tem a matriz de encodings (float32), os ids por linha, os nomes, as
+tolerâncias próprias e a versão aplicada por pessoa, mais um SHA-256 que cobre
+o cabeçalho e os dados. A versão do pacote é a marca d'água da galeria (o maior
+`atualizado_em` aplicado). Um pacote delta (--since ou --base) leva só as
+pessoas alteradas a partir de uma versão base e a lista de ids existentes, para
+remover as apagadas: nós com link lento transferem só o que mudou.
+
+Na importação os dados são lidos do pacote mapeado em memória e gravados no
+formato de `FaceGallery.save`; ao subir, o nó mapeia o cache com
+`FaceGallery.load` e o `sync` traz do banco só o que mudou depois da versão do
+pacote. Importe com o nó parado (ou reinicie-o depois).
+
+Uso:
+    python gallery_bundle.py export galeria.fgb
+    python gallery_bundle.py export galeria-delta.fgb --base galeria.fgb
+    python gallery_bundle.py import galeria.fgb
+    python gallery_bundle.py import galeria-delta.fgb --dir /var/lib/face/gallery_snapshot
+    python gallery_bundle.py info galeria.fgb
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from gallery import FaceGallery, GalleryState
+
+BUNDLE_MAGIC = b'FGBUNDLE'
+BUNDLE_FORMAT = 1
+# Início dos arrays alinhado, para o np.memmap ler direto do arquivo
+BUNDLE_ALIGN = 64
+# Magia + tamanho do cabeçalho JSON (uint32 little-endian)
+_PREFIX = struct.Struct('<8sI')
+
+# Pacote lido: cabeçalho (dict) e os arrays mapeados em memória
+Bundle = namedtuple('Bundle', ['header', 'matrix', 'ids'])
+
+
+def _align(offset):
+    return -(-offset // BUNDLE_ALIGN) * BUNDLE_ALIGN
+
+
+def _canonical(header):
+    """Cabeçalho sem o checksum, serializado de forma estável para o SHA-256."""
+    header = {key: value for key, value in header.items() if key != 'sha256'}
+    return json.dumps(header, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _layout(header_size, rows, dim):
+    """Offsets da matriz e dos ids e o tamanho total do arquivo."""
+    matrix_offset = _align(_PREFIX.size + header_size)
+    ids_offset = _align(matrix_offset + rows * dim * 4)
+    return matrix_offset, ids_offset, ids_offset + rows * 8
+
+
+def _isoformat(stamp):
+    return stamp.isoformat() if stamp else None
+
+
+def _parse_stamp(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def export_bundle(gallery, path, since=None, source=None):
+    """
+    Grava a galeria em `path` (troca atômica) e retorna o cabeçalho.
+
+    Com `since` (datetime), o pacote é delta: só as pessoas com versão
+    a partir de `since`. `source` identifica o banco de origem, como em
+    `FaceGallery.save`.
+    """
+    state = gallery.state()
+    matrix, ids, names, tolerances = state.matrix, state.ids, state.names, state.tolerances
+    people = sorted(set(state.applied) | set(np.unique(ids).tolist()))
+    applied = state.applied
+    if since is not None:
+        applied = {pessoa_id: stamp for pessoa_id, stamp in applied.items() if stamp >= since}
+        keep = np.isin(ids, list(applied))
+        matrix, ids, names, tolerances = matrix[keep], ids[keep], names[keep], tolerances[keep]
+    elif not len(ids):
+        raise ValueError("galeria vazia: nada para exportar")
+
+    header = {
+        'format': BUNDLE_FORMAT,
+        'kind': 'delta' if since is not None else 'full',
+        'source': source,
+        'dim': gallery.dim,
+        'rows': len(ids),
+        'version': _isoformat(state.watermark),
+        'base': _isoformat(since),
+        'created_at': datetime.datetime.utcnow().isoformat(),
+        'applied': {str(pessoa_id): stamp.isoformat() for pessoa_id, stamp in applied.items()},
+        'names': dict(zip(map(str, ids.tolist()), names.tolist())),
+        'tolerances': {str(pessoa_id): tolerance for pessoa_id, tolerance
+                       in zip(ids.tolist(), tolerances.tolist()) if not np.isnan(tolerance)},
+    }
+    if since is not None:
+        header['people'] = people
+
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    ids = np.ascontiguousarray(ids, dtype='<i8')
+    digest = hashlib.sha256(_canonical(header))
+    digest.update(memoryview(matrix).cast('B'))
+    digest.update(memoryview(ids).cast('B'))
+    header['sha256'] = digest.hexdigest()
+    encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    matrix_offset, ids_offset, size = _layout(len(encoded), len(ids), gallery.dim)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_PREFIX.pack(BUNDLE_MAGIC, len(encoded)))
+        f.write(encoded)
+        f.seek(matrix_offset)
+        f.write(memoryview(matrix).cast('B'))
+        f.seek(ids_offset)
+        f.write(memoryview(ids).cast('B'))
+        f.truncate(size)
+    os.replace(tmp, path)
+    return header
+
+
+def read_bundle(path, verify=True):
+    """
+    Abre o pacote com os arrays mapeados em memória (np.memmap).
+
+    Com `verify`, confere o SHA-256 lendo o arquivo em blocos. Erros de
+    formato ou checksum levantam ValueError.
+    """
+    with open(path, 'rb') as f:
+        magic, header_size = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"{path} não é um pacote da galeria")
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    if header.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"formato de pacote não suportado: {header.get('format')}")
+    rows, dim = header['rows'], header['dim']
+    matrix_offset, ids_offset, size = _layout(header_size, rows, dim)
+    if os.path.getsize(path) != size:
+        raise ValueError(f"pacote truncado ou corrompido: {os.path.getsize(path)} bytes, esperado {size}")
+
+    if verify:
+        digest = hashlib.sha256(_canonical(header))
+        with open(path, 'rb') as f:
+            for offset, length in ((matrix_offset, rows * dim * 4), (ids_offset, rows * 8)):
+                f.seek(offset)
+                while length:
+                    chunk = f.read(min(length, 1 << 20))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    length -= len(chunk)
+        if digest.hexdigest() != header.get('sha256'):
+            raise ValueError("checksum do pacote não confere")
+
+    if not rows:
+        return Bundle(header, np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=np.int64))
+    matrix = np.memmap(path, dtype=np.float32, mode='r', offset=matrix_offset, shape=(rows, dim))
+    ids = np.memmap(path, dtype='<i8', mode='r', offset=ids_offset, shape=(rows,))
+    return Bundle(header, matrix, ids)
+
+
+def bundle_state(bundle):
+    """`GalleryState` com as linhas e versões do pacote."""
+    header = bundle.header
+    ids = np.asarray(bundle.ids, dtype=np.int64)
+    names = np.array([header['names'][str(pessoa_id)] for pessoa_id in ids.tolist()], dtype=object)
+    own = header['tolerances']
+    tolerances = np.array([own.get(str(pessoa_id), np.nan) for pessoa_id in ids.tolist()], dtype=np.float32)
+    applied = {int(pessoa_id): _parse_stamp(stamp) for pessoa_id, stamp in header['applied'].items()}
+    return GalleryState(bundle.matrix, ids, names, tolerances, applied, _parse_stamp(header['version']), None)
+
+
+def import_bundle(path, directory, source=None):
+    """
+    Importa o pacote no cache local em `directory`, gravado com `source`.
+
+    Um pacote completo substitui o cache; um delta é aplicado sobre o cache
+    existente, que precisa estar na versão base do delta ou depois dela.
+    Retorna o número de pessoas gravadas ou alteradas.
+    """
+    bundle = read_bundle(path)
+    header = bundle.header
+    state = bundle_state(bundle)
+    gallery = FaceGallery(dim=header['dim'])
+    if header['kind'] == 'full':
+        gallery.restore(state)
+        changed = len(state.applied)
+    else:
+        if not gallery.load(directory, source=source):
+            raise ValueError(f"sem cache local utilizável em {directory}: importe antes um pacote completo")
+        base = _parse_stamp(header['base'])
+        if base is not None and (gallery.watermark is None or gallery.watermark < base):
+            raise ValueError(f"o cache local está na versão {_isoformat(gallery.watermark)}, "
+                             f"anterior à base do delta ({header['base']})")
+        changed = gallery.apply_delta(header['people'], state)
+    gallery.save(directory, source=source)
+    return changed
+
+
+def describe(header, path):
+    size = os.path.getsize(path)
+    kind = f"delta desde {header['base']}" if header['kind'] == 'delta' else 'completo'
+    print(f"📦 {path}: pacote {kind}, versão {header['version']}")
+    print(f"   {header['rows']} encoding(s) de {len(header['applied'])} pessoa(s), dim {header['dim']}, "
+          f"{size / 1e6:.1f} MB, origem {header['source']}, criado em {header['created_at']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="exporta a galeria do banco para um pacote")
+    export.add_argument('path', help="arquivo do pacote")
+    since = export.add_mutually_exclusive_group()
+    since.add_argument('--since', type=datetime.datetime.fromisoformat,
+                       help="delta com as pessoas alteradas a partir desta versão (data ISO)")
+    since.add_argument('--base', help="delta a partir da versão de um pacote já distribuído")
+    restore = commands.add_parser('import', help="importa um pacote no cache local da galeria")
+    restore.add_argument('path', help="arquivo do pacote")
+    restore.add_argument('--dir', help="pasta do cache (padrão: FACE_GALLERY_SNAPSHOT_DIR)")
+    restore.add_argument('--force', action='store_true',
+                         help="importa mesmo que o pacote venha de outro banco")
+    info = commands.add_parser('info', help="mostra o cabeçalho de um pacote e confere o checksum")
+    info.add_argument('path', help="arquivo do pacote")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'info':
+            describe(read_bundle(args.path).header, args.path)
+            print("✅ Checksum confere")
+            return
+
+        # Importado aqui: `info` não precisa do app nem do banco
+        import app
+        if args.command == 'export':
+            since = args.since
+            if args.base:
+                since = _parse_stamp(read_bundle(args.base, verify=False).header['version'])
+            with app.app.app_context():
+                app.db.create_all()
+            app.load_known_faces(background=False)
+            header = export_bundle(app.gallery, args.path, since=since, source=app.gallery_snapshot_source)
+            describe(header, args.path)
+        else:
+            directory = args.dir or app.gallery_snapshot_dir
+            if not directory:
+                raise ValueError("FACE_GALLERY_SNAPSHOT_DIR está desativado: indique a pasta com --dir")
+            header = read_bundle(args.path, verify=False).header
+            if header['source'] != app.gallery_snapshot_source and not args.force:
+                raise ValueError("o pacote vem de outro banco (DATABASE_URL diferente); use --force para importar")
+            changed = import_bundle(args.path, directory, source=app.gallery_snapshot_source)
+            print(f"✅ {changed} pessoa(s) importada(s) em {directory}, versão {header['version']}")
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        parser.exit(2, f"❌ {e}\n")
+
+
+if __name__ == '__main__':
+    main()
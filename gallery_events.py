@@ -0,0 +1,137 @@
+# gallery_events.py
+import datetime
+import os
+import select
+import threading
+import time
+
+from sqlalchemy import func
+
+from database import GALLERY_CHANNEL, VersaoGaleria, db
+from observability import Counter, Histogram, get_logger
+
+log = get_logger('gallery_events')
+
+# Eventos do log `gallery_version` mais velhos que isto (segundos) são apagados
+EVENTS_RETENTION = 24 * 3600
+CLEANUP_INTERVAL = 3600
+
+EVENTS_APPLIED = Counter('face_gallery_events_total', 'Alterações da galeria aplicadas neste processo',
+                         labels=('operacao',))
+EVENT_LAG = Histogram('face_gallery_event_lag_seconds', 'Tempo entre gravar uma alteração e aplicá-la neste processo')
+
+
+class GalleryChangeFeed:
+    """
+    Leva para a galeria deste processo as alterações feitas em qualquer
+    worker ou script, a partir do log `gallery_version` (ver
+    `database.registrar_alteracao_galeria`).
+
+    No Postgres (psycopg2), uma conexão dedicada faz LISTEN no canal da
+    galeria e cada NOTIFY acorda a thread na hora; a cada `listen_timeout`
+    segundos o log também é conferido, caso algum aviso se perca. Nos demais
+    bancos (SQLite), o log é consultado a cada `poll_interval` segundos.
+    Em ambos os casos só as pessoas citadas nos eventos novos são relidas.
+
+    Um evento cuja transação confirma depois de outra com id maior pode ser
+    pulado; a sincronização periódica por `atualizado_em` (GalleryRefresher)
+    continua como rede de segurança.
+    """
+
+    def __init__(self, app, gallery, poll_interval=0.5, listen_timeout=5.0):
+        self.app = app
+        self.gallery = gallery
+        self.poll_interval = poll_interval
+        self.listen_timeout = listen_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_cleanup = 0.0
+        # Maior id do log já aplicado
+        self.last_id = None
+        self.mode = None
+        self.events = 0
+
+    def ensure_started(self):
+        """Marca o ponto de partida no log e inicia a thread (uma vez por processo)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            with self.app.app_context():
+                self.last_id = db.session.query(func.max(VersaoGaleria.id)).scalar() or 0
+            threading.Thread(target=self._run, name='gallery-events', daemon=True).start()
+            self._pid = os.getpid()
+
+    def catch_up(self):
+        """Aplica os eventos gravados depois de `last_id`. Retorna quantos."""
+        with self.app.app_context():
+            events = (db.session.query(VersaoGaleria.id, VersaoGaleria.pessoa_id, VersaoGaleria.operacao,
+                                       VersaoGaleria.criado_em)
+                      .filter(VersaoGaleria.id > self.last_id).order_by(VersaoGaleria.id).all())
+            if not events:
+                return 0
+            self.gallery.apply_people(event.pessoa_id for event in events)
+        now = datetime.datetime.utcnow()
+        for event in events:
+            EVENTS_APPLIED.inc(operacao=event.operacao)
+            EVENT_LAG.observe(max(0.0, (now - event.criado_em).total_seconds()))
+        self.last_id = events[-1].id
+        self.events += len(events)
+        log.debug(f"📨 {len(events)} alteração(ões) da galeria aplicada(s)", extra={'last_id': self.last_id})
+        return len(events)
+
+    def stats(self):
+        return {'mode': self.mode, 'last_id': self.last_id, 'events': self.events}
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    dialect = db.engine.dialect
+                if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+                    self._listen_loop()
+                else:
+                    self._poll_loop()
+            except Exception:
+                log.exception("❌ Erro ao acompanhar as alterações da galeria")
+                time.sleep(max(self.poll_interval, 1.0))
+
+    def _poll_loop(self):
+        self.mode = 'poll'
+        while True:
+            self.catch_up()
+            self._cleanup()
+            time.sleep(self.poll_interval)
+
+    def _listen_loop(self):
+        with self.app.app_context():
+            raw = db.engine.raw_connection()
+        # Conexão só deste listener: não volta para o pool com o LISTEN ativo
+        raw.detach()
+        conn = raw.driver_connection
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {GALLERY_CHANNEL}')
+            self.mode = 'listen'
+            log.info(f"📡 Galeria acompanhando alterações por LISTEN {GALLERY_CHANNEL}")
+            while True:
+                # Os eventos de antes do LISTEN são pegos na primeira volta
+                self.catch_up()
+                self._cleanup()
+                if select.select([conn], [], [], self.listen_timeout)[0]:
+                    conn.poll()
+                    # O aviso só acorda a thread: o conteúdo vem do log
+                    conn.notifies.clear()
+        finally:
+            conn.close()
+
+    def _cleanup(self):
+        if time.monotonic() - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = time.monotonic()
+        limite = datetime.datetime.utcnow() - datetime.timedelta(seconds=EVENTS_RETENTION)
+        with self.app.app_context():
+            db.session.query(VersaoGaleria).filter(VersaoGaleria.criado_em < limite).delete()
+            db.session.commit()
@@ -0,0 +1,185 @@
+# inference_pool.py
+import math
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from face_pipeline import warm_up
+from observability import STAGE_SECONDS, get_logger
+
+log = get_logger('inference')
+
+
+class PoolSaturated(Exception):
+    """A fila do pool está cheia; `retry_after` estima em quantos segundos tentar de novo."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Pool de inferência cheio, tente de novo em {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """A tarefa não terminou (ou nem começou) dentro do prazo da requisição."""
+
+
+def _run_task(fn, args, submitted_at, deadline):
+    """Executado no processo do pool: mede a espera na fila e o tempo de execução."""
+    started = time.time()
+    if deadline and started > deadline:
+        # A requisição já desistiu: não gasta CPU com ela
+        raise DeadlineExceeded("Prazo esgotado antes do início da tarefa")
+    result = fn(*args)
+    return result, started - submitted_at, time.time() - started
+
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            'mean_ms': round(self.total / self.count * 1000, 2) if self.count else None,
+            'max_ms': round(self.max * 1000, 2),
+            'count': self.count,
+        }
+
+
+class InferencePool:
+    """
+    Pool fixo de processos para as chamadas pesadas do dlib (detecção e encoding).
+
+    Os processos são criados por fork do worker do servidor, que já tem os
+    modelos carregados, e aquecidos uma vez. A fila é limitada: com
+    `workers + max_queue` tarefas em andamento, `submit` falha na hora com
+    `PoolSaturated` em vez de acumular requisições. Cada tarefa tem um prazo;
+    se ele passar, `result` levanta `DeadlineExceeded` e a tarefa ainda na
+    fila é cancelada (ou descartada pelo processo ao começar).
+    """
+
+    def __init__(self, workers, max_queue, timeout=10.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._pid = None
+        self._in_flight = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.wait = _StageStats()
+        self.run = _StageStats()
+
+    def _get_executor(self):
+        with self._lock:
+            # Um pool herdado por fork não funciona no filho: cria outro
+            if self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+                self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+                self._in_flight = 0
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                log.error("♻️  Pool de inferência quebrado (processo morreu): recriando")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+
+    def retry_after(self):
+        """Segundos estimados até a fila andar: tarefas na frente × tempo médio / processos."""
+        mean_run = self.run.total / self.run.count if self.run.count else 1.0
+        return max(1, math.ceil(self._in_flight * mean_run / self.workers))
+
+    def submit(self, fn, *args, deadline=None):
+        """
+        Enfileira `fn(*args)` e retorna o Future. `deadline` é um instante
+        (time.time()); por padrão, agora + `timeout`.
+        """
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolSaturated(self.retry_after())
+        deadline = deadline or time.time() + self.timeout
+        try:
+            try:
+                future = executor.submit(_run_task, fn, args, time.time(), deadline)
+            except BrokenProcessPool:
+                self._reset(executor)
+                future = self._get_executor().submit(_run_task, fn, args, time.time(), deadline)
+        except Exception:
+            self._slots.release()
+            raise
+        future.deadline = deadline
+        with self._lock:
+            self._in_flight += 1
+            self.submitted += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if not future.cancelled() and future.exception() is None:
+                _, waited, ran = future.result()
+                self.wait.add(waited)
+                self.run.add(ran)
+                STAGE_SECONDS.observe(waited, stage='queue_wait')
+        self._slots.release()
+
+    def result(self, future):
+        """Espera o resultado até o prazo da tarefa."""
+        try:
+            result, _, _ = future.result(timeout=max(0.0, future.deadline - time.time()))
+            return result
+        except (FutureTimeoutError, CancelledError, DeadlineExceeded):
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise DeadlineExceeded("Prazo da requisição esgotado no pool de inferência")
+        except BrokenProcessPool:
+            with self._lock:
+                self.failed += 1
+            self._reset(self._executor)
+            raise
+
+    def call(self, fn, *args, deadline=None):
+        """Atalho para `result(submit(...))`."""
+        return self.result(self.submit(fn, *args, deadline=deadline))
+
+    def shutdown(self, wait=True):
+        """Encerra os processos do pool (criados de novo no próximo `submit`)."""
+        with self._lock:
+            executor, self._executor, self._pid = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'timeout': self.timeout,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.workers),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'failed': self.failed,
+                'wait': self.wait.as_dict(),
+                'run': self.run.as_dict(),
+            }
@@ -0,0 +1,254 @@
+# matching.py
+from collections import namedtuple
+
+import numpy as np
+
+# Tolerância padrão do `face_recognition.compare_faces`
+DEFAULT_TOLERANCE = 0.6
+
+# Candidatos buscados por face; o segundo colocado é procurado entre eles
+MATCH_CANDIDATES = 16
+
+# Com `top` > 0, linhas buscadas por pessoa pedida: uma pessoa pode ocupar
+# várias das linhas mais próximas antes de aparecer a seguinte
+TOP_ROWS_PER_PERSON = 4
+
+# Agregação dos encodings de cada pessoa em um template (FACE_TEMPLATE_MODE no .env)
+TEMPLATE_MODES = ('none', 'centroid', 'medoid')
+
+# Pessoas pré-selecionadas pelos templates e reordenadas com todos os seus encodings
+TEMPLATE_SHORTLIST = 10
+
+# Resultado do reconhecimento de uma face:
+# - index: linha da galeria mais próxima (-1 se a galeria estiver vazia)
+# - distance: distância euclidiana até essa linha
+# - runner_up_distance: menor distância até uma identidade *diferente*
+# - margin: runner_up_distance - distance (inf se houver só uma identidade)
+# - threshold: tolerância aplicada (a da pessoa mais próxima ou a global)
+# - candidates: com `top` > 0, as pessoas mais próximas (lista de `Candidate`)
+FaceMatch = namedtuple('FaceMatch', [
+    'index', 'pessoa_id', 'name', 'distance', 'runner_up_distance', 'margin', 'recognized',
+    'threshold', 'candidates',
+], defaults=(DEFAULT_TOLERANCE, None))
+
+# Uma pessoa da lista de candidatos: a menor distância até seus encodings e a tolerância dela
+Candidate = namedtuple('Candidate', ['pessoa_id', 'name', 'distance', 'threshold'])
+
+# Um template por pessoa: matriz (P, 128), ids (P,), normas e, para cada
+# pessoa p, suas linhas na galeria em rows[offsets[p]:offsets[p + 1]].
+TemplateSet = namedtuple('TemplateSet', ['matrix', 'ids', 'sq_norms', 'rows', 'offsets'])
+
+
+def squared_norms(vectors):
+    """Retorna ||v||² de cada linha de `vectors` como float32."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return np.einsum('ij,ij->i', vectors, vectors)
+
+
+def distance_matrix(queries, matrix, sq_norms=None):
+    """
+    Calcula a matriz (faces x galeria) de distâncias euclidianas em uma só operação.
+
+    Usa a expansão ||a||² + ||b||² - 2ab, de modo que o custo dominante é
+    um único produto de matrizes (BLAS) em vez de um laço por face.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, matrix.shape[1])
+    if sq_norms is None:
+        sq_norms = squared_norms(matrix)
+    sq = squared_norms(queries)[:, None] + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    # Erros de arredondamento podem deixar valores levemente negativos
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+def top_k(distances, k):
+    """
+    Retorna (índices, distâncias) dos k menores valores de cada linha, em ordem crescente.
+
+    Usa `argpartition` (O(N)) e só ordena os k selecionados.
+    """
+    k = min(k, distances.shape[1])
+    if k < distances.shape[1]:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(k), distances.shape).copy()
+    part_d = np.take_along_axis(distances, part, axis=1)
+    order = np.argsort(part_d, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_d, order, axis=1)
+
+
+def build_templates(matrix, ids, mode='centroid'):
+    """
+    Agrega os encodings de cada pessoa em um único template.
+
+    - centroid: média dos encodings da pessoa
+    - medoid: o encoding da pessoa mais próximo de todos os outros dela
+    """
+    if mode not in TEMPLATE_MODES or mode == 'none':
+        raise ValueError(f"Modo de template inválido: {mode} (use centroid ou medoid)")
+    rows = np.argsort(ids, kind='stable')
+    sorted_ids = ids[rows]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if len(ids) else np.empty(0, int)
+    offsets = np.r_[starts, len(ids)]
+    grouped = matrix[rows]
+
+    if mode == 'centroid':
+        counts = np.diff(offsets).astype(np.float32)
+        templates = np.add.reduceat(grouped, starts, axis=0) / counts[:, None] if len(ids) else grouped
+    else:
+        templates = np.empty((len(starts), matrix.shape[1]), dtype=np.float32)
+        for p in range(len(starts)):
+            block = grouped[offsets[p]:offsets[p + 1]]
+            templates[p] = block[distance_matrix(block, block).sum(axis=1).argmin()]
+
+    templates = np.ascontiguousarray(templates, dtype=np.float32)
+    return TemplateSet(templates, sorted_ids[starts], squared_norms(templates), rows, offsets)
+
+
+def remove_template_people(templates, pessoa_ids, keep=None):
+    """
+    Tira de `templates` as pessoas `pessoa_ids`, sem recalcular as demais.
+
+    `keep` é a máscara das linhas que continuam na galeria (compactada):
+    os índices de linha das pessoas restantes são renumerados por ela.
+    """
+    people = ~np.isin(templates.ids, np.asarray(pessoa_ids, dtype=np.int64))
+    counts = np.diff(templates.offsets)
+    rows = templates.rows[np.repeat(people, counts)]
+    if keep is not None:
+        rows = (np.cumsum(keep) - 1)[rows]
+    return TemplateSet(templates.matrix[people], templates.ids[people], templates.sq_norms[people],
+                       rows, np.r_[0, np.cumsum(counts[people])])
+
+
+def append_template_rows(templates, matrix, ids, start, mode='centroid'):
+    """
+    Atualiza `templates` com as linhas `start:` da galeria (`matrix`, `ids`).
+
+    Só as pessoas dessas linhas têm o template recalculado (com todas as
+    linhas delas); as demais ficam como estão, sem reordenar a galeria.
+    """
+    if start >= len(ids):
+        return templates
+    people = np.unique(ids[start:])
+    touched = np.isin(templates.ids, people)
+    counts = np.diff(templates.offsets)
+    previous = templates.rows[np.repeat(touched, counts)]
+    if touched.any():
+        templates = remove_template_people(templates, templates.ids[touched])
+    subset = np.r_[previous, np.arange(start, len(ids))].astype(templates.rows.dtype)
+    fresh = build_templates(matrix[subset], ids[subset], mode)
+    return TemplateSet(np.concatenate([templates.matrix, fresh.matrix]),
+                       np.concatenate([templates.ids, fresh.ids]),
+                       np.concatenate([templates.sq_norms, fresh.sq_norms]),
+                       np.concatenate([templates.rows, subset[fresh.rows]]),
+                       np.r_[templates.offsets, templates.offsets[-1] + fresh.offsets[1:]])
+
+
+def _two_stage_search(queries, snapshot, k, shortlist):
+    """
+    Busca em duas etapas: primeiro compara as faces com um template por
+    pessoa, depois reordena só as `shortlist` pessoas mais próximas usando
+    todos os seus encodings. Retorna (índices, distâncias) (F, k).
+    """
+    templates = snapshot.templates
+    first = top_k(distance_matrix(queries, templates.matrix, templates.sq_norms), shortlist)[0]
+
+    indices = np.full((len(queries), k), -1, dtype=np.int64)
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    for i, people in enumerate(first):
+        rows = np.concatenate([templates.rows[templates.offsets[p]:templates.offsets[p + 1]] for p in people])
+        d = distance_matrix(queries[i], snapshot.matrix[rows], snapshot.sq_norms[rows])
+        top, top_d = top_k(d, k)
+        indices[i, :top.shape[1]] = rows[top[0]]
+        distances[i, :top.shape[1]] = top_d[0]
+    return indices, distances
+
+
+def row_thresholds(snapshot, rows, tolerance):
+    """Tolerância de cada linha dada: a da pessoa, se ela tiver uma, ou a global."""
+    own = snapshot.tolerances[np.maximum(rows, 0)]
+    # Guardadas em float32: arredonda para devolver 0.5 e não 0.5000000x
+    return np.where(np.isnan(own), tolerance, own.astype(np.float64).round(6))
+
+
+def _top_people(snapshot, indices, distances, thresholds, top):
+    """As `top` primeiras pessoas distintas de uma linha de candidatos (já em ordem crescente)."""
+    people, seen = [], set()
+    for index, distance, threshold in zip(indices.tolist(), distances.tolist(), thresholds.tolist()):
+        if index < 0:
+            break
+        pessoa_id = int(snapshot.ids[index])
+        if pessoa_id in seen:
+            continue
+        seen.add(pessoa_id)
+        people.append(Candidate(pessoa_id, snapshot.names[index], distance, threshold))
+        if len(people) == top:
+            break
+    return people
+
+
+def match_faces(queries, snapshot, tolerance=DEFAULT_TOLERANCE, min_margin=0.0, top=0,
+                candidates=MATCH_CANDIDATES, shortlist=TEMPLATE_SHORTLIST):
+    """
+    Compara todas as faces consultadas com a galeria de uma só vez.
+
+    `snapshot` é um `gallery.GallerySnapshot`. Se a galeria tiver templates
+    por pessoa, a busca é feita em duas etapas (templates e depois os
+    encodings das `shortlist` pessoas mais próximas); senão, pelo backend do
+    snapshot (exato ou aproximado). Em ambos os casos são considerados os
+    `candidates` vizinhos mais próximos de cada face.
+
+    A face é reconhecida se a distância até a pessoa mais próxima ficar
+    dentro da tolerância dela (`snapshot.tolerances`, ou `tolerance` para
+    quem não tem uma) e se a margem até a segunda pessoa for de pelo menos
+    `min_margin` (conjunto aberto: duas pessoas quase empatadas viram
+    "Desconhecido"). Com `top` > 0, cada resultado traz também as `top`
+    pessoas mais próximas, para revisão manual. Retorna uma lista de
+    `FaceMatch`, na mesma ordem de `queries`.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, snapshot.matrix.shape[1])
+    if len(queries) == 0:
+        return []
+    if len(snapshot.ids) == 0:
+        return [FaceMatch(-1, None, "Desconhecido", float('inf'), float('inf'), float('inf'), False,
+                          tolerance, [] if top else None)
+                for _ in range(len(queries))]
+
+    k = max(candidates, top * TOP_ROWS_PER_PERSON)
+    if snapshot.templates is not None:
+        indices, distances = _two_stage_search(queries, snapshot, k, shortlist)
+    else:
+        indices, distances = snapshot.index.search(queries, snapshot, k)
+    best = indices[:, 0]
+    best_distances = distances[:, 0]
+    thresholds = row_thresholds(snapshot, best, tolerance)
+
+    # Segunda melhor identidade: ignora os candidatos da mesma pessoa
+    candidate_ids = np.where(indices >= 0, snapshot.ids[indices], -1)
+    other_person = (candidate_ids != candidate_ids[:, :1]) & (indices >= 0)
+    runner_up = np.where(other_person, distances, np.inf).min(axis=1)
+    margins = runner_up - best_distances
+
+    # Busca aproximada pode não achar candidato algum (listas vazias)
+    recognized = (best >= 0) & (best_distances <= thresholds) & (margins >= min_margin)
+
+    results = []
+    for i in range(len(queries)):
+        index = int(best[i])
+        people = None
+        if top:
+            people = _top_people(snapshot, indices[i], distances[i],
+                                 row_thresholds(snapshot, indices[i], tolerance), top)
+        results.append(FaceMatch(
+            index=index,
+            pessoa_id=int(snapshot.ids[index]) if recognized[i] else None,
+            name=snapshot.names[index] if recognized[i] else "Desconhecido",
+            distance=float(best_distances[i]),
+            runner_up_distance=float(runner_up[i]),
+            margin=float(margins[i]),
+            recognized=bool(recognized[i]),
+            threshold=float(thresholds[i]),
+            candidates=people,
+        ))
+    return results
@@ -0,0 +1,101 @@
+# migrar_encodings.py
+"""
+Converte os encodings antigos em JSON (`Pessoa.encodings_json`) para a
+tabela binária `FaceEncoding` (float32, 512 bytes por encoding).
+
+Pessoas cujo JSON não pode ser lido (ou não traz vetores de 128 números)
+são contadas e mantidas no formato antigo, para não saírem da galeria sem
+aviso; com --skip-invalid elas são migradas sem encodings.
+
+Uso:
+    python migrar_encodings.py                  # migra todas as pessoas pendentes
+    python migrar_encodings.py --dry-run        # só mostra o que seria migrado
+    python migrar_encodings.py --skip-invalid   # descarta os JSON inválidos
+"""
+import argparse
+import json
+
+import numpy as np
+
+from app import app, db
+from database import ENCODING_DIM, FaceEncoding, Pessoa, atualizar_esquema, set_person_encodings
+
+# Pessoas migradas por transação
+BATCH_SIZE = 500
+
+
+def ler_encodings(encodings_json):
+    """Lista de encodings do JSON antigo. Levanta ValueError se o conteúdo não for válido."""
+    lista = json.loads(encodings_json)
+    if not isinstance(lista, list):
+        raise ValueError("o JSON não é uma lista")
+    for encoding in lista:
+        vetor = np.asarray(encoding, dtype=np.float32)
+        if vetor.shape != (ENCODING_DIM,) or not np.isfinite(vetor).all():
+            raise ValueError(f"encoding com formato {vetor.shape}, esperado ({ENCODING_DIM},)")
+    return lista
+
+
+def migrar(dry_run=False, skip_invalid=False):
+    """Migra as pessoas pendentes. Retorna quantas ficaram no formato antigo por JSON inválido."""
+    with app.app_context():
+        db.create_all()
+        atualizar_esquema()
+
+        # Pessoas que ainda têm JSON e nenhuma linha em FaceEncoding
+        pendentes = (Pessoa.query
+                     .filter(Pessoa.encodings_json != '[]')
+                     .filter(~Pessoa.encodings.any())
+                     .order_by(Pessoa.id))
+        total = pendentes.count()
+        print(f"🔄 Pessoas a migrar: {total}")
+
+        migradas = encodings = bytes_json = invalidas = mantidas = 0
+        while True:
+            # Pessoas não gravadas continuam pendentes (e vêm antes das demais,
+            # pela ordem do id): avança pelo offset
+            query = pendentes.offset(migradas if dry_run else mantidas)
+            lote = query.limit(BATCH_SIZE).all()
+            if not lote:
+                break
+            for pessoa in lote:
+                try:
+                    lista = ler_encodings(pessoa.encodings_json)
+                except ValueError as e:  # json.JSONDecodeError também é ValueError
+                    invalidas += 1
+                    if not skip_invalid:
+                        print(f"❌ JSON inválido para {pessoa.nome} (id {pessoa.id}): {e} — mantido no formato antigo")
+                        mantidas += 1
+                        continue
+                    print(f"⚠️  JSON inválido para {pessoa.nome} (id {pessoa.id}): {e} — migrada sem encodings")
+                    lista = []
+                bytes_json += len(pessoa.encodings_json)
+                encodings += len(lista)
+                if not dry_run:
+                    set_person_encodings(pessoa, lista)
+            migradas += len(lote)
+            if not dry_run:
+                db.session.commit()
+            print(f"   {migradas}/{total} pessoas")
+
+        bytes_bin = encodings * 512
+        print(f"✅ {encodings} encodings: {bytes_json} bytes em JSON -> {bytes_bin} bytes em binário")
+        if dry_run:
+            print("   (dry-run: nada foi gravado)")
+        print(f"   Linhas em face_encoding: {FaceEncoding.query.count()}")
+        if invalidas and skip_invalid:
+            print(f"⚠️  {invalidas} pessoa(s) com JSON inválido migrada(s) sem encodings (fora da galeria)")
+        elif invalidas:
+            print(f"❌ {invalidas} pessoa(s) com JSON inválido mantida(s) no formato antigo: "
+                  "corrija o JSON ou rode com --skip-invalid")
+        return mantidas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migra encodings JSON para a tabela FaceEncoding.")
+    parser.add_argument('--dry-run', action='store_true', help="não grava nada, só relata")
+    parser.add_argument('--skip-invalid', action='store_true',
+                        help="migra sem encodings as pessoas com JSON inválido (elas saem da galeria)")
+    args = parser.parse_args()
+    if migrar(dry_run=args.dry_run, skip_invalid=args.skip_invalid):
+        raise SystemExit(1)
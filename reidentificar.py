@@ -0,0 +1,335 @@
+# reidentificar.py
+"""
+Reprocessa um acervo de imagens contra a galeria atual: detecção, encoding
+e busca, em lote e com retomada.
+
+Serve para auditar frames guardados ou, depois de cadastrar alguém, para
+completar o histórico de acessos com as imagens antigas. As imagens vêm de
+uma pasta (percorrida recursivamente, em ordem estável) ou de um manifesto
+CSV com uma imagem por linha: `caminho[,data_hora ISO,origem]`.
+
+Os arquivos são lidos, decodificados, detectados e codificados num pool de
+processos, em blocos de --chunk imagens, com no máximo 2 blocos por processo
+em andamento ou prontos esperando a vez (memória limitada mesmo com milhões
+de arquivos). A busca na galeria é feita no processo principal, uma operação
+matricial por bloco.
+Os resultados saem na ordem do acervo:
+- --output: um JSON por imagem (caminho, faces com caixa, nome, distância...);
+- --access-log: um `RegistroAcesso` por face, com a data da imagem (do
+  manifesto ou a data de modificação do arquivo), gravado em inserts em massa.
+
+A cada --batch-size imagens os resultados são gravados e o checkpoint
+(--checkpoint) é atualizado com a posição no acervo e o tamanho do --output.
+Rodar o mesmo comando de novo continua de onde parou; o que foi gravado
+depois do último checkpoint é descartado (o --output é truncado e os
+registros de acesso são regravados pela mesma chave), então nada sai em dobro.
+
+Uso:
+    python reidentificar.py /dados/frames --output resultados.jsonl
+    python reidentificar.py --manifest frames.csv --access-log --only-recognized --workers 8
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from sqlalchemy import delete, insert
+
+from app import app, detection_profile, gallery, load_known_faces, match_options
+from database import RegistroAcesso, db
+from face_pipeline import IMAGE_EXTENSIONS, process_image_files, profile_from_request, warm_up
+from matching import match_faces
+
+# Imagens por tarefa do pool e imagens entre duas gravações (e checkpoints)
+CHUNK_SIZE = 16
+BATCH_SIZE = 500
+# Intervalo mínimo, em segundos, entre duas linhas de progresso
+PROGRESS_INTERVAL = 10.0
+CHECKPOINT_FORMAT = 1
+
+# Uma imagem do acervo: caminho, data/hora da captura (None = data do arquivo) e origem
+Item = namedtuple('Item', ['path', 'data_hora', 'origem'])
+
+
+def iter_directory(root):
+    """Imagens de `root` e subpastas, em ordem alfabética estável (a posição é o checkpoint)."""
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield Item(os.path.join(dirpath, filename), None, None)
+
+
+def iter_manifest(path):
+    """Linhas do manifesto CSV; caminhos relativos são relativos à pasta do manifesto."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].startswith('#'):
+                continue
+            data_hora = datetime.datetime.fromisoformat(row[1].strip()) if len(row) > 1 and row[1].strip() else None
+            origem = row[2].strip() if len(row) > 2 and row[2].strip() else None
+            yield Item(os.path.join(base, row[0].strip()), data_hora, origem)
+
+
+def face_key(path, face):
+    """Chave estável de uma face do acervo, gravada em `RegistroAcesso.sessao` (regravação idempotente)."""
+    return hashlib.md5(f"{path}#{face}".encode()).hexdigest()
+
+
+def load_checkpoint(path, signature):
+    """Checkpoint salvo para a mesma execução, ou None. Levanta ValueError se for de outra."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get('format') != CHECKPOINT_FORMAT or checkpoint.get('signature') != signature:
+        raise ValueError(f"O checkpoint {path} é de outra execução (use --restart para começar do zero)")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """Grava o checkpoint num arquivo temporário e o troca atomicamente."""
+    checkpoint['updated_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m{seconds % 60:02d}s"
+
+
+class Job:
+    """Estado de uma execução: saídas, contadores e o checkpoint."""
+
+    def __init__(self, args, signature, total):
+        self.args = args
+        self.total = total
+        self.checkpoint = None if args.restart else load_checkpoint(args.checkpoint, signature)
+        if self.checkpoint is None:
+            self.checkpoint = {'format': CHECKPOINT_FORMAT, 'signature': signature, 'done': 0, 'output_bytes': 0,
+                               'stats': {'images': 0, 'faces': 0, 'recognized': 0, 'errors': 0, 'records': 0}}
+        self.stats = self.checkpoint['stats']
+        self.output = None
+        if args.output:
+            self.output = open(args.output, 'a+b')
+            # Descarta o que foi escrito depois do último checkpoint
+            self.output.truncate(self.checkpoint['output_bytes'])
+            self.output.seek(self.checkpoint['output_bytes'])
+        self.lines = []
+        self.records = []
+        self.keys = []
+        self.pending = 0
+        self.started = time.perf_counter()
+        self.started_done = self.checkpoint['done']
+        self.last_progress = self.started
+
+    def add(self, item, outcome, matches, gallery_version):
+        """Acumula o resultado de uma imagem (na ordem do acervo)."""
+        self.pending += 1
+        self.stats['images'] += 1
+        result = {'path': item.path, 'gallery_version': gallery_version, 'faces': []}
+        if isinstance(outcome, Exception):
+            self.stats['errors'] += 1
+            result['error'] = str(outcome)
+        else:
+            data_hora = item.data_hora
+            if self.args.access_log and data_hora is None:
+                data_hora = datetime.datetime.fromtimestamp(os.path.getmtime(item.path))
+            for face, (box, match) in enumerate(zip(outcome[0], matches)):
+                self.stats['faces'] += 1
+                self.stats['recognized'] += match.recognized
+                result['faces'].append({
+                    'box': list(box),
+                    'pessoa_id': match.pessoa_id,
+                    'name': match.name,
+                    'recognized': match.recognized,
+                    'distance': match.distance if np.isfinite(match.distance) else None,
+                    'margin': match.margin if np.isfinite(match.margin) else None,
+                })
+                if self.args.access_log and (match.recognized or not self.args.only_recognized):
+                    key = face_key(item.path, face)
+                    self.keys.append(key)
+                    self.records.append({
+                        'pessoa_id': match.pessoa_id, 'nome_identificado': match.name,
+                        'reconhecido': match.recognized, 'data_hora': data_hora, 'ultimo_visto': data_hora,
+                        'ocorrencias': 1, 'origem': (item.origem or self.args.origem)[:64], 'sessao': key,
+                    })
+        if self.output:
+            self.lines.append(json.dumps(result, ensure_ascii=False))
+        if self.pending >= self.args.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Grava os resultados acumulados e avança o checkpoint."""
+        if not self.pending:
+            return
+        if self.records:
+            with app.app_context():
+                # Registros de uma execução interrompida antes do checkpoint são substituídos
+                db.session.execute(delete(RegistroAcesso).where(RegistroAcesso.sessao.in_(self.keys)))
+                db.session.execute(insert(RegistroAcesso), self.records)
+                db.session.commit()
+            self.stats['records'] += len(self.records)
+        if self.output:
+            if self.lines:
+                self.output.write(('\n'.join(self.lines) + '\n').encode('utf-8'))
+            self.output.flush()
+            os.fsync(self.output.fileno())
+            self.checkpoint['output_bytes'] = self.output.tell()
+        self.checkpoint['done'] += self.pending
+        save_checkpoint(self.args.checkpoint, self.checkpoint)
+        self.lines, self.records, self.keys, self.pending = [], [], [], 0
+
+    def progress(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        done = self.checkpoint['done'] + self.pending
+        elapsed = now - self.started
+        rate = (done - self.started_done) / elapsed if elapsed else 0.0
+        line = f"   {done}" + (f"/{self.total} ({done / self.total:.1%})" if self.total else "")
+        line += f"  {rate:.1f} img/s  {self.stats['faces']} face(s), {self.stats['recognized']} reconhecida(s)"
+        if self.total and rate:
+            line += f"  ETA {format_duration((self.total - done) / rate)}"
+        print(line, flush=True)
+
+    def close(self):
+        self.flush()
+        if self.output:
+            self.output.close()
+
+
+def run(args):
+    profile = profile_from_request(vars(args), detection_profile)
+    if args.manifest:
+        source, iterate = os.path.abspath(args.manifest), lambda: iter_manifest(args.manifest)
+    else:
+        source, iterate = os.path.abspath(args.dir), lambda: iter_directory(args.dir)
+    # O checkpoint só vale para o mesmo acervo, perfil e saídas
+    signature = {'source': source, 'profile': list(profile), 'output': args.output and os.path.abspath(args.output),
+                 'access_log': args.access_log, 'only_recognized': args.only_recognized}
+
+    with app.app_context():
+        db.create_all()
+    # Sem threads de fundo: o ProcessPoolExecutor abaixo pode criar os processos com fork
+    load_known_faces(background=False)
+    snapshot = gallery.snapshot()
+    print(f"🗂️  Galeria: {len(snapshot.ids)} encoding(s), versão {snapshot.version}")
+
+    total = None if args.no_count else sum(1 for _ in iterate())
+    job = Job(args, signature, total)
+    skip = job.checkpoint['done']
+    print(f"🔁 Reidentificação de {source}: {total if total is not None else '?'} imagem(ns)"
+          + (f", retomando após {skip}" if skip else ""))
+
+    items = iterate()
+    for _ in range(skip):
+        next(items, None)
+
+    def chunks():
+        while True:
+            chunk = [item for _, item in zip(range(args.chunk), items)]
+            if not chunk:
+                return
+            yield chunk
+
+    workers = args.workers or os.cpu_count() or 1
+    pending = chunks()
+    # Blocos em andamento -> número de sequência; prontos esperam aqui até chegar a vez deles
+    in_flight, ready, submitted, next_seq = {}, {}, 0, 0
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up) as executor:
+        while True:
+            # A janela conta também os prontos fora de ordem: com um bloco lento à
+            # frente, os seguintes esperam em `ready` e nada mais é enviado
+            while len(in_flight) + len(ready) < 2 * workers:
+                chunk = next(pending, None)
+                if chunk is None:
+                    break
+                future = executor.submit(process_image_files, [item.path for item in chunk], profile)
+                in_flight[future] = (submitted, chunk)
+                submitted += 1
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                seq, chunk = in_flight.pop(future)
+                ready[seq] = (chunk, future.result())
+            # Resultados saem na ordem do acervo, para o checkpoint ser só uma posição
+            while next_seq in ready:
+                chunk, outcomes = ready.pop(next_seq)
+                next_seq += 1
+                faces = [o[1] for o in outcomes if not isinstance(o, Exception)]
+                encodings = [encoding for image_encodings in faces for encoding in image_encodings]
+                matches = iter(match_faces(encodings, snapshot, **match_options))
+                for item, outcome in zip(chunk, outcomes):
+                    if not isinstance(outcome, Exception):
+                        for stage, seconds in outcome[2].items():
+                            timings[stage] = timings.get(stage, 0.0) + seconds
+                    count = 0 if isinstance(outcome, Exception) else len(outcome[1])
+                    job.add(item, outcome, [next(matches) for _ in range(count)], snapshot.version)
+                job.progress()
+    job.close()
+    job.progress(force=True)
+
+    elapsed = time.perf_counter() - job.started
+    stats = job.stats
+    print(f"✅ {stats['images']} imagem(ns), {stats['faces']} face(s), {stats['recognized']} reconhecida(s), "
+          f"{stats['errors']} erro(s) em {format_duration(elapsed)}")
+    if args.access_log:
+        print(f"   {stats['records']} registro(s) de acesso gravado(s)")
+    processed = job.checkpoint['done'] - job.started_done
+    if processed:
+        print("   por imagem: " + ", ".join(f"{stage} {seconds / processed * 1000:.1f} ms"
+                                           for stage, seconds in timings.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('dir', nargs='?', help="pasta com as imagens (percorrida recursivamente)")
+    source.add_argument('--manifest', help="CSV com caminho[,data_hora,origem] por linha")
+    parser.add_argument('--output', help="arquivo JSON Lines com o resultado de cada imagem")
+    parser.add_argument('--access-log', action='store_true', help="grava um RegistroAcesso por face encontrada")
+    parser.add_argument('--only-recognized', action='store_true',
+                        help="com --access-log, grava só as faces reconhecidas")
+    parser.add_argument('--origem', default='reidentificacao',
+                        help="origem dos registros de acesso (quando o manifesto não traz uma)")
+    parser.add_argument('--checkpoint', help="arquivo de checkpoint (padrão: <saída ou acervo>.checkpoint.json)")
+    parser.add_argument('--restart', action='store_true', help="ignora o checkpoint e começa do zero")
+    parser.add_argument('--workers', type=int, default=None, help="processos do pool (padrão: nº de CPUs)")
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help="imagens por tarefa do pool")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="imagens entre gravações e checkpoints")
+    parser.add_argument('--no-count', action='store_true',
+                        help="não conta as imagens antes de começar (sem porcentagem nem ETA)")
+    parser.add_argument('--profile', help="perfil de detecção (rapido, padrao, preciso; padrão: o do .env)")
+    args = parser.parse_args()
+    if not args.output and not args.access_log:
+        parser.error("indique ao menos uma saída: --output e/ou --access-log")
+    if args.output and args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    if not args.checkpoint:
+        base = args.output or (args.manifest or args.dir).rstrip(os.sep)
+        args.checkpoint = f"{base}.checkpoint.json"
+    try:
+        run(args)
+    except ValueError as e:
+        parser.exit(2, f"❌ {e}\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# result_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Resultado da detecção de uma imagem. `matches` vale para a galeria na
+# versão `gallery_version` e é recalculado se a galeria mudou desde então.
+CachedFaces = namedtuple('CachedFaces', ['locations', 'encodings', 'gallery_version', 'matches'])
+
+
+def cache_key(data, profile):
+    """Chave do cache: SHA-256 dos bytes enviados mais o perfil de detecção."""
+    return f"{hashlib.sha256(data).hexdigest()}|{tuple(profile)}"
+
+
+def _entry_size(entry):
+    encodings = sum(np.asarray(e).nbytes for e in entry.encodings)
+    # Caixas e matches são pequenos; uma estimativa fixa por face basta
+    return 256 + encodings + 128 * (len(entry.locations) + len(entry.matches or ()))
+
+
+class ResultCache:
+    """
+    Cache LRU com TTL dos resultados de detecção + encoding por imagem.
+
+    Limitado por número de entradas e por bytes (estimados pelos encodings);
+    a entrada menos usada sai primeiro. Entradas mais velhas que `ttl`
+    segundos são descartadas ao serem lidas. `max_entries=0` desativa o cache.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 << 20, ttl=300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # chave -> (entrada, tamanho, instante de gravação)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if not self.max_entries:
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            entry, size, stored = item
+            if self.ttl and time.monotonic() - stored > self.ttl:
+                self._drop(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if not self.max_entries:
+            return
+        size = _entry_size(entry)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (entry, size, time.monotonic())
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def update_matches(self, key, entry, gallery_version, matches):
+        """Guarda os matches calculados para a versão atual da galeria, sem renovar o TTL."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                self._entries[key] = (entry._replace(gallery_version=gallery_version, matches=matches),
+                                      item[1], item[2])
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+            }
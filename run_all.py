@@ -1,13 +1,16 @@
 
+import argparse
 import os
 import platform
 import re
 import socket
 import subprocess
 import sys
+import time
 
 # Caminhos
 BACKEND = 'app_https.py'  # Usando versão HTTPS agora que temos certificados
+BACKEND_SERVE = 'serve.py'  # Servidor de produção (gunicorn, vários workers)
 FRONTEND = os.path.join('frontend', 'https_server.py')
 
 # Detecta o comando python correto
@@ -32,8 +35,24 @@ def run_in_terminal(cmd, title):
         # Fallback: roda no mesmo terminal
         return subprocess.Popen(cmd, shell=True)
 
-if __name__ == '__main__':
+def run_in_foreground(commands):
+    """Roda os comandos (ou processos já iniciados) neste terminal e encerra todos juntos no Ctrl+C."""
+    processes = [subprocess.Popen(cmd, shell=True) if isinstance(cmd, str) else cmd for cmd in commands]
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        print('\nEncerrando servidores...')
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inicia o backend e o frontend.")
+    parser.add_argument('--serve', action='store_true',
+                        help="backend no servidor de produção (serve.py), tudo neste terminal")
+    args = parser.parse_args()
 
     # Descobre o IP local
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -76,12 +95,25 @@ if __name__ == '__main__':
     else:
         print('API_URL já está correto.')
 
+    frontend_cmd = f'{PYTHON_CMD} {FRONTEND}'
+    if args.serve:
+        print('Iniciando backend (serve.py) e frontend (HTTPS) neste terminal...')
+        print('Acesse o frontend em: https://<seu-ip-local>:8443/index.html')
+        print('Pressione Ctrl+C para encerrar os dois servidores')
+        frontend = subprocess.Popen(frontend_cmd, shell=True)
+        # O frontend gera os certificados que o backend usa para o HTTPS
+        for _ in range(50):
+            if os.path.exists('server.pem') and os.path.exists('server.key'):
+                break
+            time.sleep(0.2)
+        run_in_foreground([frontend, f'{PYTHON_CMD} {BACKEND_SERVE}'])
+        sys.exit(0)
+
     print('Iniciando backend (Flask)...')
     backend_cmd = f'{PYTHON_CMD} {BACKEND}'
     run_in_terminal(backend_cmd, 'Backend')
 
     print('Iniciando frontend (HTTPS)...')
-    frontend_cmd = f'{PYTHON_CMD} {FRONTEND}'
     run_in_terminal(frontend_cmd, 'Frontend')
 
     print('\nAmbos os servidores foram iniciados!')
@@ -0,0 +1,212 @@
+# search_index.py
+import os
+
+import numpy as np
+
+from matching import distance_matrix, squared_norms, top_k
+
+# Backends de busca disponíveis (FACE_INDEX no .env)
+INDEX_BACKENDS = ('exact', 'ivf')
+
+# Linhas processadas por vez nas atribuições aos centróides, para limitar memória
+_CHUNK = 8192
+
+
+def _pad(indices, distances, k):
+    """Completa resultados com menos de k candidatos com -1 / inf."""
+    missing = k - indices.shape[1]
+    if missing <= 0:
+        return indices, distances
+    rows = indices.shape[0]
+    return (np.hstack([indices, np.full((rows, missing), -1, dtype=indices.dtype)]),
+            np.hstack([distances, np.full((rows, missing), np.inf, dtype=distances.dtype)]))
+
+
+def _nearest_centroid(vectors, centroids, c_norms):
+    """Atribui cada vetor ao centróide mais próximo, em blocos."""
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _CHUNK):
+        block = vectors[start:start + _CHUNK]
+        assign[start:start + len(block)] = distance_matrix(block, centroids, c_norms).argmin(axis=1)
+    return assign
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """K-means (Lloyd) em NumPy puro. Retorna os centróides (k, d) em float32."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest_centroid(vectors, centroids, squared_norms(centroids))
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Clusters vazios recebem pontos aleatórios para não desperdiçar listas
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+    return centroids
+
+
+class ExactIndex:
+    """Busca exata por força bruta sobre toda a galeria."""
+
+    name = 'exact'
+
+    def add(self, vectors):
+        pass
+
+    def remove(self, keep):
+        pass
+
+    def freeze(self, size):
+        return ExactView()
+
+
+class ExactView:
+    def search(self, queries, snapshot, k):
+        """Retorna (índices, distâncias) (F, k) dos k vizinhos mais próximos de cada consulta."""
+        distances = distance_matrix(queries, snapshot.matrix, snapshot.sq_norms)
+        return _pad(*top_k(distances, k), k)
+
+
+class IVFIndex:
+    """
+    Índice aproximado IVF: quantizador grosso k-means com listas invertidas.
+
+    Cada linha da galeria é atribuída ao centróide mais próximo. Na busca, só
+    as linhas das `nprobe` listas mais próximas da consulta são comparadas.
+    Enquanto o índice não é treinado, a busca cai para força bruta.
+    Só os centróides são persistidos: as atribuições são recalculadas quando
+    a galeria é carregada, o que custa uma multiplicação (N x nlist).
+    """
+
+    name = 'ivf'
+
+    def __init__(self, nlist=0, nprobe=8, path=None):
+        # nlist=0: escolhe automaticamente (≈ 4·√N) no treino
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.path = path
+        self.centroids = None
+        self._c_norms = None
+        # Atribuição (lista invertida) de cada linha da galeria, com capacidade extra
+        self._assign = np.empty(0, dtype=np.int32)
+        self._size = 0
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, iterations=20, seed=0):
+        """Treina o quantizador com `vectors` (todas as linhas atuais da galeria) e as reatribui."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        # Amostra limitada: o k-means não melhora muito com mais de ~256 pontos por lista
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > 256 * nlist:
+            sample = vectors[rng.choice(len(vectors), size=256 * nlist, replace=False)]
+        self._set_centroids(kmeans(sample, nlist, iterations=iterations, seed=seed))
+        self._assign = _nearest_centroid(vectors, self.centroids, self._c_norms)
+        self._size = len(vectors)
+
+    def add(self, vectors):
+        count = len(vectors)
+        needed = self._size + count
+        if needed > len(self._assign):
+            grown = np.empty(max(needed, 2 * len(self._assign), 16), dtype=np.int32)
+            grown[:self._size] = self._assign[:self._size]
+            self._assign = grown
+        if self.trained:
+            self._assign[self._size:needed] = _nearest_centroid(vectors, self.centroids, self._c_norms)
+        else:
+            self._assign[self._size:needed] = -1
+        self._size = needed
+
+    def remove(self, keep):
+        # Novo array, como na galeria, para não alterar views já congeladas
+        self._assign = self._assign[:self._size][keep]
+        self._size = len(self._assign)
+
+    def freeze(self, size):
+        if not self.trained:
+            return ExactView()
+        return IVFView(self.centroids, self._c_norms, self._assign[:size], self.nprobe)
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, nlist=len(self.centroids))
+
+    def load(self, path=None):
+        """
+        Carrega centróides salvos. Retorna False se o arquivo não existir.
+
+        Deve ser chamado antes de adicionar linhas: as atribuições são
+        calculadas à medida que a galeria é carregada.
+        """
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            self._set_centroids(data['centroids'])
+        return True
+
+    def _set_centroids(self, centroids):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._c_norms = squared_norms(self.centroids)
+
+
+class IVFView:
+    def __init__(self, centroids, c_norms, assign, nprobe):
+        self.centroids = centroids
+        self.c_norms = c_norms
+        self.assign = assign
+        self.nprobe = min(nprobe, len(centroids))
+        self._lists = None
+
+    def _build_lists(self):
+        # Ordena as linhas por lista: a lista p é order[offsets[p]:offsets[p + 1]]
+        order = np.argsort(self.assign, kind='stable')
+        counts = np.bincount(self.assign[self.assign >= 0], minlength=len(self.centroids))
+        # Linhas sem atribuição (-1) ficam no início e são puladas
+        skip = len(self.assign) - counts.sum()
+        offsets = np.concatenate([[0], np.cumsum(counts)]) + skip
+        self._lists = (order, offsets)
+
+    def search(self, queries, snapshot, k):
+        """Retorna (índices, distâncias) (F, k) aproximados, visitando `nprobe` listas por consulta."""
+        if self._lists is None:
+            self._build_lists()
+        order, offsets = self._lists
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        coarse = distance_matrix(queries, self.centroids, self.c_norms)
+        probes = top_k(coarse, self.nprobe)[0]
+
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for i, probe in enumerate(probes):
+            rows = np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probe])
+            if not len(rows):
+                continue
+            d = distance_matrix(queries[i], snapshot.matrix[rows], snapshot.sq_norms[rows])
+            top, top_d = top_k(d, k)
+            indices[i, :top.shape[1]] = rows[top[0]]
+            distances[i, :top.shape[1]] = top_d[0]
+        return indices, distances
+
+
+def create_index(backend='exact', nlist=0, nprobe=8, path=None):
+    """Cria o backend de busca configurado."""
+    if backend == 'exact':
+        return ExactIndex()
+    if backend == 'ivf':
+        index = IVFIndex(nlist=nlist, nprobe=nprobe, path=path)
+        index.load()
+        return index
+    raise ValueError(f"Backend de busca desconhecido: {backend} (use um de {INDEX_BACKENDS})")
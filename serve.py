@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# serve.py
+"""
+Servidor de produção: roda a API com o gunicorn, em vários processos.
+
+O app (modelos do dlib, galeria e índice de busca) é carregado uma única vez
+no processo mestre, antes do fork; os workers herdam essa memória e a
+compartilham por copy-on-write. As bibliotecas numéricas de cada worker
+ficam limitadas a FACE_THREADS_PER_WORKER threads, para que N workers não
+disputem os núcleos com N × núcleos threads.
+
+Configuração no .env: BACKEND_HOST, BACKEND_PORT, BACKEND_WORKERS,
+BACKEND_THREADS, BACKEND_TIMEOUT, FACE_THREADS_PER_WORKER e, para HTTPS,
+BACKEND_CERT_FILE / BACKEND_KEY_FILE (padrão: server.pem e server.key).
+
+Uso:
+    python serve.py
+    python serve.py --workers 4 --no-tls
+"""
+import argparse
+import gc
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Precisa vir antes de importar numpy/dlib: os pools de threads são criados na importação
+_THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+_threads_per_worker = os.environ.get('FACE_THREADS_PER_WORKER') or '1'
+for _var in _THREAD_VARS:
+    os.environ.setdefault(_var, _threads_per_worker)
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn não roda no Windows
+    BaseApplication = None
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1) // int(_threads_per_worker))
+
+
+def preload():
+    """Carrega o app, aquece o detector e a galeria no processo mestre."""
+    from app import app, gallery, load_known_faces
+    from face_pipeline import warm_up
+
+    print("🔥 Pré-carregando modelos e galeria antes do fork...")
+    warm_up()
+    # Snapshot gravado aqui mesmo, sem thread: nada pode estar com um lock na hora do fork
+    load_known_faces(background=False)
+    print(f"✅ Galeria pré-carregada: {len(gallery)} encoding(s)")
+    return app
+
+
+def wait_for_threads(timeout=30):
+    """
+    Espera as threads do mestre terminarem antes do fork: um worker herda os
+    locks que elas estiverem segurando, mas não as threads que os soltariam.
+    """
+    deadline = time.monotonic() + timeout
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join(max(0.0, deadline - time.monotonic()))
+    alive = [thread.name for thread in threading.enumerate() if thread is not threading.current_thread()]
+    if alive:
+        print(f"⚠️  Threads ainda ativas no mestre antes do fork: {', '.join(alive)}")
+
+
+def post_fork(server, worker):
+    """Cada worker abre as próprias conexões com o banco."""
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+if BaseApplication:
+    class FaceServer(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            application = preload()
+            wait_for_threads()
+            # Objetos do mestre não mudam mais: tirá-los do GC evita que a coleta
+            # nos workers toque (e copie) as páginas compartilhadas
+            gc.freeze()
+            return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('BACKEND_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('BACKEND_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('BACKEND_WORKERS') or default_workers()))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('BACKEND_THREADS') or 1),
+                        help="threads por worker (mais de 1 usa o worker gthread)")
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('BACKEND_TIMEOUT') or 60))
+    parser.add_argument('--no-tls', action='store_true', help="serve HTTP mesmo se houver certificados")
+    args = parser.parse_args()
+
+    if BaseApplication is None:
+        print("❌ gunicorn não está instalado (ou não é suportado neste sistema).")
+        print("   Instale com 'pip install gunicorn' ou use 'python app_https.py' no Windows.")
+        raise SystemExit(1)
+
+    options = {
+        'bind': f"{args.host}:{args.port}",
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'accesslog': '-',
+    }
+    cert_file = os.environ.get('BACKEND_CERT_FILE') or 'server.pem'
+    key_file = os.environ.get('BACKEND_KEY_FILE') or 'server.key'
+    tls = not args.no_tls and os.path.exists(cert_file) and os.path.exists(key_file)
+    if tls:
+        options.update(certfile=cert_file, keyfile=key_file)
+    elif not args.no_tls:
+        print(f"⚠️  Certificados não encontrados ({cert_file}, {key_file}): servindo sem HTTPS")
+
+    # Lido pelo app no preload: os pools de inferência dos workers dividem as CPUs
+    os.environ.setdefault('FACE_INFERENCE_WORKERS', str(max(1, (os.cpu_count() or 1) // args.workers)))
+
+    print(f"🚀 Servidor de produção em {'https' if tls else 'http'}://{args.host}:{args.port} "
+          f"({args.workers} worker(s) × {args.threads} thread(s), {_threads_per_worker} thread(s) numérica(s) cada)")
+    FaceServer(options).run()
+
+
+if __name__ == '__main__':
+    main()